@@ -1,8 +1,14 @@
+import asyncio
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from endpoints import products, healthcheck
+from endpoints import products, healthcheck, admin, publish, images
 from database.firebase import initialize_firestore
+from database.publish_queue import create_publish_queue
+from services.render_services import shutdown_render_pool
+from services.archive_services import shutdown_upload_coalescer, warm_github_clone
+from services.publish_services import start_publish_scheduler
+from services.pattern_services import warm_printify_cache
 
 # Load environment variables from .env file
 load_dotenv('.env')
@@ -13,7 +19,29 @@ async def lifespan(app: FastAPI):
     # Initialize Firestore and store it in app state
     app.state.firestore_db = initialize_firestore()
     print("Firestore initialized at startup.")
+    # Products are published from the queue in the background
+    app.state.publish_queue = create_publish_queue(app.state.firestore_db)
+    publish_task = start_publish_scheduler(app.state.publish_queue)
+    # Fetch the Printify store and catalog before the first request needs them
+    try:
+        await asyncio.to_thread(warm_printify_cache)
+        print("Printify cache warmed at startup.")
+    except Exception as e:
+        print(f"Failed to warm the Printify cache: {e}")
+    # Clone the image repository in the background, when uploads need it
+    warm_github_clone()
     yield
+    # Stop publishing, unfinished claims are retried once their lease runs out
+    if publish_task is not None:
+        publish_task.cancel()
+        try:
+            await publish_task
+        except asyncio.CancelledError:
+            pass
+    # Stop the rendering processes
+    shutdown_render_pool()
+    # Finish pushing the queued images to GitHub
+    shutdown_upload_coalescer()
     # Terminate Firestore connection
     app.state.firestore_db.close()
     print("Application shutdown.")
@@ -24,3 +52,6 @@ app = FastAPI(lifespan=lifespan)
 # Include routers
 app.include_router(products.router)
 app.include_router(healthcheck.router)
+app.include_router(admin.router)
+app.include_router(publish.router)
+app.include_router(images.router)
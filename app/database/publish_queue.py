@@ -0,0 +1,223 @@
+"""This module stores the products waiting to be published to Printify."""
+import os
+import threading
+import time
+
+from fastapi import Request
+from firebase_admin import firestore
+
+# "firestore" shares the queue between replicas, "local" keeps it in memory for tests
+PUBLISH_QUEUE_BACKEND = os.getenv("PUBLISH_QUEUE_BACKEND", "firestore")
+# Attempts before a product is marked failed
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", "5"))
+# Seconds before the first retry of a failed publish, doubled on every attempt
+PUBLISH_RETRY_DELAY = int(os.getenv("PUBLISH_RETRY_DELAY", "60"))
+# Seconds a claimed product is reserved for, after which another scheduler may retry it
+PUBLISH_LEASE = 300
+PUBLISH_QUEUE_COLLECTION = "PublishQueue"
+
+
+class PublishQueue:
+    """
+    The products waiting to be published, one item per product ID. An item
+    is "queued" until a scheduler claims it, "publishing" while it holds the
+    claim, then "published", or "failed" once its attempts run out. Items
+    are due from their next_attempt_at time, which is None once they are
+    done, so a crashed scheduler's claims become due again when the lease
+    runs out.
+
+    This queue keeps its items in memory. Subclasses keep them elsewhere by
+    overriding update, get, due and items.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def update(self, product_id: str, change):
+        """
+        Applies a change to an item atomically.
+        Args:
+            change (callable): Called with the item, None if there is none,
+                and returns the new item, or None to leave it unchanged.
+        Returns:
+            dict: The new item, or None if it was left unchanged.
+        """
+        with self.lock:
+            item = change(dict(self.entries[product_id]) if product_id in self.entries else None)
+            if item is not None:
+                self.entries[product_id] = item
+            return item
+
+    def get(self, product_id: str):
+        """Returns the item of a product, or None if it was never queued."""
+        with self.lock:
+            item = self.entries.get(product_id)
+            return dict(item) if item else None
+
+    def due(self, now: float, limit: int):
+        """Returns the IDs of up to limit products that are due, the longest waiting first."""
+        with self.lock:
+            due = [
+                item for item in self.entries.values()
+                if item["next_attempt_at"] is not None and item["next_attempt_at"] <= now
+            ]
+        due.sort(key=lambda item: item["next_attempt_at"])
+        return [item["product_id"] for item in due[:limit]]
+
+    def items(self, status: str = None, limit: int = 100):
+        """Returns up to limit items, optionally only those with a status."""
+        with self.lock:
+            items = [
+                dict(item) for item in self.entries.values()
+                if status is None or item["status"] == status
+            ]
+        return items[:limit]
+
+    def enqueue(self, product_id: str, store_id=None):
+        """
+        Queues a product to be published as soon as the publish budget allows, returns its item.
+        A product queued again keeps its shop unless store_id is given.
+        """
+        now = time.time()
+
+        def change(item):
+            return {
+                "product_id": product_id,
+                "store_id": item.get("store_id") if item and store_id is None else store_id,
+                "status": "queued",
+                "attempts": 0,
+                "error": None,
+                "next_attempt_at": now,
+                "created_at": item["created_at"] if item else now,
+                "updated_at": now
+            }
+
+        return self.update(product_id, change)
+
+    def claim(self, product_id: str):
+        """Reserves a due product for publishing, returns its item or None if it is not due anymore."""
+        now = time.time()
+
+        def change(item):
+            if item is None or item["next_attempt_at"] is None or item["next_attempt_at"] > now:
+                return None
+            item.update({
+                "status": "publishing",
+                "attempts": item["attempts"] + 1,
+                "next_attempt_at": now + PUBLISH_LEASE,
+                "updated_at": now
+            })
+            return item
+
+        return self.update(product_id, change)
+
+    def succeed(self, product_id: str):
+        """Marks a claimed product as published."""
+        now = time.time()
+
+        def change(item):
+            item.update({
+                "status": "published",
+                "error": None,
+                "next_attempt_at": None,
+                "updated_at": now
+            })
+            return item
+
+        return self.update(product_id, change)
+
+    def fail(self, product_id: str, error: str):
+        """Schedules a retry of a claimed product with backoff, or marks it failed once its attempts run out."""
+        now = time.time()
+
+        def change(item):
+            if item["attempts"] >= PUBLISH_MAX_ATTEMPTS:
+                item.update({"status": "failed", "next_attempt_at": None})
+            else:
+                delay = PUBLISH_RETRY_DELAY * 2 ** (item["attempts"] - 1)
+                item.update({"status": "queued", "next_attempt_at": now + delay})
+            item.update({"error": error, "updated_at": now})
+            return item
+
+        return self.update(product_id, change)
+
+
+class FirestorePublishQueue(PublishQueue):
+    """A publish queue kept in the PublishQueue collection, shared by every replica."""
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+        self.collection = db.collection(PUBLISH_QUEUE_COLLECTION)
+
+    def update(self, product_id: str, change):
+        document = self.collection.document(product_id)
+
+        @firestore.transactional
+        def update_in_transaction(transaction):
+            snapshot = document.get(transaction=transaction)
+            item = change(snapshot.to_dict() if snapshot.exists else None)
+            if item is not None:
+                transaction.set(document, item)
+            return item
+
+        return update_in_transaction(self.db.transaction())
+
+    def get(self, product_id: str):
+        snapshot = self.collection.document(product_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def due(self, now: float, limit: int):
+        # Items that are done have no next_attempt_at and never match
+        query = (
+            self.collection
+            .where(filter=firestore.FieldFilter("next_attempt_at", "<=", now))
+            .order_by("next_attempt_at")
+            .limit(limit)
+        )
+        return [snapshot.id for snapshot in query.get()]
+
+    def items(self, status: str = None, limit: int = 100):
+        query = self.collection
+        if status is not None:
+            query = query.where(filter=firestore.FieldFilter("status", "==", status))
+        return [snapshot.to_dict() for snapshot in query.limit(limit).get()]
+
+
+def create_publish_queue(db):
+    """Creates the publish queue of PUBLISH_QUEUE_BACKEND, db is the Firestore client."""
+    if PUBLISH_QUEUE_BACKEND == "local":
+        return PublishQueue()
+    return FirestorePublishQueue(db)
+
+
+def get_publish_queue(request: Request):
+    """Dependency to get the publish queue from app state."""
+    return request.app.state.publish_queue
+
+
+if __name__ == "__main__":
+    # Example usage with the in memory queue, the Firestore queue behaves the same
+    queue = PublishQueue()
+    queue.enqueue("product-1", store_id=1)
+    queue.enqueue("product-2")
+    now = time.time()
+    print(f"Due: {queue.due(now, 10)}")
+
+    # A scheduler claims a product, no other scheduler can until the lease runs out
+    item = queue.claim("product-1")
+    print(f"Claimed: {item['status']}, attempt {item['attempts']}, claimed again: {queue.claim('product-1')}")
+
+    # A failed publish is retried after PUBLISH_RETRY_DELAY
+    item = queue.fail("product-1", "Printify rejected the publish request")
+    print(f"Failed: {item['status']}, retry in {item['next_attempt_at'] - now:.0f}s, due: {queue.due(time.time(), 10)}")
+
+    # Queued again without a shop, the product keeps its shop
+    item = queue.enqueue("product-1")
+    print(f"Queued again: {item['status']} in shop {item['store_id']}")
+
+    queue.claim("product-1")
+    queue.succeed("product-1")
+    print(f"Published: {[item['product_id'] for item in queue.items('published')]}")
+    print(f"Due: {queue.due(time.time(), 10)}")
@@ -0,0 +1,61 @@
+import asyncio
+
+from fastapi import APIRouter, Depends
+
+from services.render_services import get_render_stats
+from util.font_cache import font_cache_stats
+from util.printify.printify_cache import printify_cache
+from util.printify.async_printify_util import AsyncPrintifyUtil
+from res.models.requests import RepairProductsRequest
+from middleware.security import verify_api_key
+
+router = APIRouter()
+
+
+@router.delete("/printify_cache")
+def invalidate_printify_cache(
+    prefix: str = "",
+    api_key: str = Depends(verify_api_key)
+):
+    """This endpoint removes cached Printify data so it is fetched again, optionally only the paths starting with prefix."""
+    count = printify_cache.invalidate(prefix)
+    return {
+        "message": f"Removed {count} Printify cache entries",
+        "count": count
+    }
+
+
+@router.get("/render_stats")
+def render_stats(
+    api_key: str = Depends(verify_api_key)
+):
+    """This endpoint reports the render cache hit rate of the render pool and the font cache counters of this process."""
+    return {
+        "render_cache": get_render_stats(),
+        "font_cache": font_cache_stats()
+    }
+
+
+async def repair_printify_products(request: RepairProductsRequest):
+    """Repairs the requested products with one Printify client."""
+    async with AsyncPrintifyUtil() as printify:
+        return await printify.repair_products(
+            request.product_ids,
+            front_images_only=request.front_images_only,
+            disable_unavailable=request.disable_unavailable,
+            store_id=request.store_id
+        )
+
+
+@router.post("/printify/repair_products")
+def repair_products(
+    request: RepairProductsRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """This endpoint removes the back mockups and unavailable variants from products, such as those never published or published by earlier versions."""
+    results = asyncio.run(repair_printify_products(request))
+    repaired = sum(1 for result in results.values() if result == "repaired")
+    return {
+        "message": f"Repaired {repaired} of {len(results)} products",
+        "results": results
+    }
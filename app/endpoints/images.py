@@ -0,0 +1,34 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Header
+from fastapi.responses import FileResponse, JSONResponse, Response
+
+from services.hosting_services import IMAGE_CACHE_CONTROL, get_local_image_path
+
+router = APIRouter()
+
+
+@router.get("/images/{key}")
+def get_image(
+    key: str,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    This endpoint serves the print files of the local image host to Printify.
+    The key is the hash of the file, so it doubles as its ETag and the file
+    can be cached for good. No API key, Printify fetches the files.
+    """
+    path = get_local_image_path(key)
+    if path is None or not os.path.isfile(path):
+        return JSONResponse(
+            content={"message": "Image not found"},
+            status_code=404
+        )
+    headers = {
+        "ETag": f'"{key.split(".")[0]}"',
+        "Cache-Control": IMAGE_CACHE_CONTROL
+    }
+    if if_none_match and (if_none_match.strip() == "*" or headers["ETag"] in if_none_match):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
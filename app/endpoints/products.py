@@ -5,6 +5,7 @@ from fastapi.responses import JSONResponse
 
 # from database.firebase import FireStore
 from services.pattern_services import process_patterns_and_idea
+from util.image_util import preview_text_image
 from services.shopify_services import set_taxonomy_nodeID
 from services.database_services import (
     write_tshirt_to_firestore,
@@ -13,12 +14,14 @@ from services.database_services import (
     count_collection
 )
 from database.firebase import get_firestore_db
+from database.publish_queue import get_publish_queue
 from res.models.objects import TshirtWithIds, QueueItem
 from res.models.requests import (
     PatternRequest,
-    PatternQueuePostRequest
+    PatternQueuePostRequest,
+    PreviewRequest
 )
-from res.models.responses import PatternResponse
+from res.models.responses import PatternResponse, PreviewResponse, TextPreview
 from middleware.security import verify_api_key
 
 router = APIRouter()
@@ -29,13 +32,15 @@ router = APIRouter()
 def process_patterns(
     request: PatternRequest,
     api_key: str = Depends(verify_api_key),
-    firestore_db=Depends(get_firestore_db)
+    firestore_db=Depends(get_firestore_db),
+    publish_queue=Depends(get_publish_queue)
 ):
-    """This endpoint creates the patterns with ideas provided by the user."""
+    """This endpoint creates the patterns with ideas provided by the user, publishing is queued."""
     patterns = process_patterns_and_idea(
         request.patterns,
         request.idea,
-        request.publish
+        request.publish,
+        publish_queue=publish_queue
     )
 
     response_patterns = []
@@ -50,6 +55,24 @@ def process_patterns(
     )
 
 
+@router.post("/preview_patterns",
+             response_model=PreviewResponse)
+def preview_patterns(
+    request: PreviewRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """This endpoint checks how each text would fit on a print image without rendering it."""
+    previews = []
+    for text in request.texts:
+        preview = preview_text_image(text, request.height, request.width)
+        previews.append(TextPreview(text=text, **preview))
+
+    return PreviewResponse(
+        message="Previewed Patterns Successfully",
+        previews=previews
+    )
+
+
 @router.get("/fix_tax_category")
 def correct_taxonomy():
     message = set_taxonomy_nodeID()
@@ -80,7 +103,8 @@ def add_patterns_to_queue(
 def process_pattern_queue(
     publish: bool = False,
     api_key: str = Depends(verify_api_key),
-    firestore_db=Depends(get_firestore_db)
+    firestore_db=Depends(get_firestore_db),
+    publish_queue=Depends(get_publish_queue)
 ):
     """This endpoint processes the pattern queue."""
 
@@ -99,7 +123,8 @@ def process_pattern_queue(
             publish=publish
         ),
         api_key=api_key,
-        firestore_db=firestore_db
+        firestore_db=firestore_db,
+        publish_queue=publish_queue
     )
 
 
@@ -0,0 +1,55 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from database.publish_queue import get_publish_queue
+from res.models.objects import PublishItem
+from res.models.responses import PublishQueueResponse
+from middleware.security import verify_api_key
+
+router = APIRouter()
+
+
+@router.get("/publish_queue",
+            response_model=PublishQueueResponse)
+def list_publish_queue(
+    status: Optional[str] = None,
+    limit: int = 100,
+    api_key: str = Depends(verify_api_key),
+    publish_queue=Depends(get_publish_queue)
+):
+    """This endpoint lists the products of the publish queue, optionally only those with a status."""
+    items = [PublishItem(**item) for item in publish_queue.items(status, limit)]
+    return PublishQueueResponse(
+        message=f"Found {len(items)} products",
+        items=items
+    )
+
+
+@router.get("/publish_queue/{product_id}",
+            response_model=PublishItem)
+def get_publish_status(
+    product_id: str,
+    api_key: str = Depends(verify_api_key),
+    publish_queue=Depends(get_publish_queue)
+):
+    """This endpoint returns the publish status of a product."""
+    item = publish_queue.get(product_id)
+    if item is None:
+        return JSONResponse(
+            content={"message": "Product was never queued for publishing"},
+            status_code=404
+        )
+    return PublishItem(**item)
+
+
+@router.post("/publish_queue/{product_id}",
+             response_model=PublishItem)
+def queue_product_for_publishing(
+    product_id: str,
+    api_key: str = Depends(verify_api_key),
+    publish_queue=Depends(get_publish_queue)
+):
+    """This endpoint queues a product for publishing, or again after it failed."""
+    return PublishItem(**publish_queue.enqueue(product_id))
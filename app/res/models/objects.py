@@ -23,6 +23,10 @@ class TshirtWithIds(TshirtFromAi):
     """A pydantic model that extends TshirtFromAi with a product_id"""
     product_id: str
     image_ids: list[str]
+    # The Printify shop the product was created in
+    shop_id: Optional[int] = None
+    # Set when the product was queued for publishing
+    publish_status: Optional[str] = None
 
 
 class ProductQueue(BaseModel):
@@ -35,3 +39,18 @@ class ProductQueue(BaseModel):
 class QueueItem(ProductQueue):
     """A pydantic model that extends ProductQueue with a timestamp"""
     timestamp: datetime
+
+
+# DB COLLECTION: PublishQueue
+class PublishItem(BaseModel):
+    """A product waiting to be published, or the outcome of publishing it"""
+    product_id: str
+    store_id: Optional[int] = None
+    # queued, publishing, published or failed
+    status: str
+    attempts: int
+    error: Optional[str] = None
+    # Epoch seconds, None once the product is published or failed
+    next_attempt_at: Optional[float] = None
+    created_at: float
+    updated_at: float
@@ -1,9 +1,13 @@
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from res.models.objects import ProductQueue
 
+# Limits of a preview request, the print images are 2000x2000
+MAX_PREVIEW_SIZE = 10000
+MAX_PREVIEW_TEXTS = 100
+
 
 class PatternRequest(BaseModel):
     patterns: Optional[int] = 3
@@ -13,3 +17,17 @@ class PatternRequest(BaseModel):
 
 class PatternQueuePostRequest(BaseModel):
     queue: list[ProductQueue]
+
+
+class PreviewRequest(BaseModel):
+    texts: list[str] = Field(max_length=MAX_PREVIEW_TEXTS)
+    height: int = Field(2000, gt=0, le=MAX_PREVIEW_SIZE)
+    width: int = Field(2000, gt=0, le=MAX_PREVIEW_SIZE)
+
+
+class RepairProductsRequest(BaseModel):
+    product_ids: list[str]
+    front_images_only: Optional[bool] = True
+    disable_unavailable: Optional[bool] = True
+    # The shop of the products, the first shop of the account by default
+    store_id: Optional[int] = None
@@ -2,7 +2,7 @@ from typing import Optional, Dict
 
 from pydantic import BaseModel
 
-from res.models.objects import TshirtWithIds
+from res.models.objects import TshirtWithIds, PublishItem
 
 
 class PatternResponse(BaseModel):
@@ -10,6 +10,24 @@ class PatternResponse(BaseModel):
     patterns: list[TshirtWithIds]
 
 
+class TextPreview(BaseModel):
+    text: str
+    fits: bool
+    font_size: int
+    line_count: int
+    fill_ratio: float
+
+
+class PreviewResponse(BaseModel):
+    message: str
+    previews: list[TextPreview]
+
+
 class HealthcheckResponse(BaseModel):
     status: str
     details: Optional[Dict[str, str]] = None
+
+
+class PublishQueueResponse(BaseModel):
+    message: str
+    items: list[PublishItem]
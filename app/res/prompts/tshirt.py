@@ -10,3 +10,22 @@ Unisex Gildan T-Shirt - Made with medium fabric (5.3 oz/yd² (180 g/m²)) consis
 user_message = """
 I have a t-shirt business and I need your help to come up with creative, fun, unique, and interesting t-shirt designs. I would like you to generate %s patterns relating tho this idea: %s. The product_name is the name of the product and it will be displayed as the product name, it should be similar to the text of the shirt with but end in the word 't-shirt'. The description is a short description of the product, and the description of the item it will be printed on can be found below. You can use parts of this in the description, but keep it witty yet classy. The tshirt_text is the text that will be printed on the t-shirt. Do not put the tshirt_text in quotes, please. This field is your time to shine, I believe in your ability to help me create amazing products! The marketing_tags are the tags that will be used to market the t-shirt, these should be relevant to the idea and usable for marketing purposes. Please make sure that the patterns are unique and creative. Thank you!
 """
+
+# Added to each part of a batch generated in parallel, so the parts do not repeat each other
+chunk_message = """
+Other writers are generating the rest of this batch at the same time, so avoid the most obvious takes on the idea. For this part of the batch: %s
+"""
+
+# The angle of each part of a batch, in turn
+diversity_hints = [
+    "lean into puns and wordplay.",
+    "write short, punchy one-liners of a few words.",
+    "go for dry, deadpan humor.",
+    "make it wholesome and uplifting.",
+    "use pop culture and nostalgia references.",
+    "take an absurd, surreal angle.",
+    "write from the point of view of an insider or enthusiast of the idea.",
+    "play with rhymes and rhythm.",
+    "be sarcastic and a little self-deprecating.",
+    "keep it minimal and clever, made for designers.",
+]
@@ -0,0 +1,170 @@
+"""This file archives the rendered images to GitHub off the request path."""
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from util.github_util import GH_UPLOAD_MODE, GithubUploader
+
+# A commit is made once this many images are waiting
+GH_COALESCE_MAX_IMAGES = int(os.getenv("GH_COALESCE_MAX_IMAGES", "200"))
+# Or once the oldest waiting images have waited this many seconds
+GH_COALESCE_WAIT = float(os.getenv("GH_COALESCE_WAIT", "2"))
+
+
+class UploadCoalescer:
+    """
+    Collects the images of concurrent pipeline runs and pushes them to GitHub
+    together, in one commit, once GH_COALESCE_MAX_IMAGES images are waiting
+    or the oldest have waited GH_COALESCE_WAIT seconds. The busier the
+    pipeline, the more images share a commit. A single thread makes the
+    commits, one after the other.
+    """
+
+    def __init__(self, max_images: int = GH_COALESCE_MAX_IMAGES, max_wait: float = GH_COALESCE_WAIT):
+        self.max_images = max_images
+        self.max_wait = max_wait
+        # (folder_name, images, future, queued_at) of each submitted batch
+        self.pending = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.uploader = None
+        self.thread = threading.Thread(target=self.run, name="archive", daemon=True)
+        self.thread.start()
+
+    def submit(self, folder_name: str, images):
+        """
+        Queues a batch of images for the next commit.
+        Args:
+            folder_name (str): The folder of the repository the images go in.
+            images (ImageBatch): The images, closed once pushed.
+        Returns:
+            Future: The SHA of the commit once the images are pushed, None when
+                it is not known, or the exception if pushing them failed.
+        """
+        future = Future()
+        with self.condition:
+            if self.closed:
+                images.close()
+                raise RuntimeError("The GitHub archive is shut down")
+            self.pending.append((folder_name, images, future, time.monotonic()))
+            self.condition.notify()
+        return future
+
+    def take_due(self):
+        """Waits until the waiting batches are due for a commit and takes them, returns [] once shut down."""
+        with self.condition:
+            while True:
+                if self.pending:
+                    due_at = self.pending[0][3] + self.max_wait
+                    waiting_images = sum(len(images) for _, images, _, _ in self.pending)
+                    if self.closed or waiting_images >= self.max_images or time.monotonic() >= due_at:
+                        batches, self.pending = self.pending, []
+                        return batches
+                    self.condition.wait(due_at - time.monotonic())
+                elif self.closed:
+                    return []
+                else:
+                    self.condition.wait()
+
+    def run(self):
+        """Commits the waiting batches until shut down."""
+        while True:
+            batches = self.take_due()
+            if not batches:
+                return
+            self.push(batches)
+
+    def push(self, batches):
+        """Pushes the images of several batches in one commit, then tells their waiters."""
+        try:
+            if self.uploader is None:
+                self.uploader = GithubUploader(
+                    "",
+                    os.getenv("GH_UPLOAD_REPO"),
+                    os.getenv("GH_PAT")
+                )
+            commit_sha = self.uploader.upload_folders(
+                [(folder_name, images) for folder_name, images, _, _ in batches])
+            print(f"Archived {sum(len(images) for _, images, _, _ in batches)} images "
+                  f"from {len(batches)} runs to GitHub in one commit")
+            for _, _, future, _ in batches:
+                future.set_result(commit_sha)
+        except Exception as e:
+            print(f"Failed to archive {len(batches)} runs to GitHub: {e}")
+            for _, _, future, _ in batches:
+                future.set_exception(e)
+        finally:
+            for _, images, _, _ in batches:
+                images.close()
+
+    def shutdown(self):
+        """Pushes the waiting images, then stops the thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_upload_coalescer():
+    """Returns the coalescer that archives images, starting it on first use."""
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = UploadCoalescer()
+        return _coalescer
+
+
+def shutdown_upload_coalescer():
+    """Waits for the queued archives to finish, if the coalescer was started."""
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is not None:
+            _coalescer.shutdown()
+            _coalescer = None
+
+
+def archive_images(folder_name: str, images):
+    """
+    Queues a batch of images to be archived to GitHub in the background,
+    in the same commit as the images of other runs queued around it.
+    Args:
+        folder_name (str): The folder of the repository the images go in.
+        images (ImageBatch): The images, the archive closes them once pushed.
+    Returns:
+        Future: Done once the images are archived, see UploadCoalescer.submit.
+    """
+    return get_upload_coalescer().submit(folder_name, images)
+
+
+def warm_clone():
+    """Clones the GitHub repository, or brings the clone up to date."""
+    try:
+        uploader = GithubUploader(
+            "",
+            os.getenv("GH_UPLOAD_REPO"),
+            os.getenv("GH_PAT")
+        )
+        uploader.warm()
+        print("GitHub clone warmed.")
+    except Exception as e:
+        print(f"Failed to warm the GitHub clone: {e}")
+
+
+def warm_github_clone():
+    """
+    Warms the GitHub clone in the background, when uploads go through it,
+    so the first upload after a deploy does not clone.
+    Returns:
+        Thread: The thread warming the clone, None when there is no clone to warm.
+    """
+    if GH_UPLOAD_MODE != "clone" or not os.getenv("GH_UPLOAD_REPO"):
+        return None
+    # Uploads through the clone wait for it to be warm
+    thread = threading.Thread(target=warm_clone, name="warm-clone", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,148 @@
+"""This file stores the print files where Printify can fetch them by URL."""
+import abc
+import hashlib
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from services.archive_services import archive_images
+from util.s3_util import S3Uploader
+
+# Where the print files are hosted: "github", "local" (served by this app) or "s3"
+IMAGE_HOST = os.getenv("IMAGE_HOST", "github")
+# The local host's directory, and the public URL of this app it is served from
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "./image_store")
+IMAGE_STORE_URL = os.getenv("IMAGE_STORE_URL", "")
+# Images uploaded to S3 at once
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "8"))
+
+# Content addressed files never change, so they can be cached for good
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# The key of a content addressed file: the SHA-256 of its bytes and its extension
+IMAGE_KEY_PATTERN = re.compile(r"[0-9a-f]{64}\.[a-z0-9]+")
+
+
+def content_key(name: str, data: bytes):
+    """Returns the content addressed key of an image, such as '<sha256>.png'."""
+    extension = os.path.splitext(name)[1].lower() or ".png"
+    return f"{hashlib.sha256(data).hexdigest()}{extension}"
+
+
+def store_path(directory: str, key: str):
+    """Returns the path of an image in a local store, in a subdirectory per first two characters of its key."""
+    return os.path.join(directory, key[:2], key)
+
+
+class ImageHost(abc.ABC):
+    """
+    Where the print files are stored for Printify to fetch them. Every host
+    returns a URL per image, once the image is reachable there.
+    """
+
+    @abc.abstractmethod
+    def publish(self, folder_name: str, images):
+        """
+        Stores a batch of images, then closes it.
+        Args:
+            folder_name (str): The folder of the pipeline run, for hosts that group images by run.
+            images (ImageBatch): The images, the host closes them once stored.
+        Returns:
+            dict: The URL of each image, by name.
+        """
+
+
+class GithubImageHost(ImageHost):
+    """Pushes the images into a folder of the GitHub repository, GH_CONTENT_PREFIX is where its files are served from."""
+
+    def __init__(self, content_prefix: str = None):
+        self.content_prefix = content_prefix or os.getenv("GH_CONTENT_PREFIX")
+
+    def publish(self, folder_name: str, images):
+        names = images.names()
+        # Shares a commit with the other runs pushing now
+        archive_images(folder_name, images).result()
+        return {name: f"{self.content_prefix}/{folder_name}/{quote(name)}" for name in names}
+
+
+class LocalImageHost(ImageHost):
+    """
+    Writes the images into a local directory by the hash of their bytes,
+    served by the app at /images. Identical images are stored once.
+    """
+
+    def __init__(self, directory: str = IMAGE_STORE_DIR, base_url: str = IMAGE_STORE_URL):
+        # Printify cannot fetch a relative URL
+        if not base_url:
+            raise ValueError("IMAGE_STORE_URL must be set to the public URL of the app for the local image host")
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+
+    def path(self, key: str):
+        """Returns the path of a stored image, see store_path."""
+        return store_path(self.directory, key)
+
+    def publish(self, folder_name: str, images):
+        with images:
+            urls = {}
+            for name in images.names():
+                data = images.read(name)
+                key = content_key(name, data)
+                path = self.path(key)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # Readers never see a partly written file
+                    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                    with open(temp_path, "wb") as image_file:
+                        image_file.write(data)
+                    os.replace(temp_path, path)
+                urls[name] = f"{self.base_url}/images/{key}"
+            return urls
+
+
+class S3ImageHost(ImageHost):
+    """Uploads the images to an S3 compatible bucket by the hash of their bytes."""
+
+    def __init__(self, uploader: S3Uploader = None):
+        self.uploader = uploader or S3Uploader()
+
+    def upload(self, name: str, data: bytes):
+        """Uploads one image, returns its URL."""
+        return self.uploader.put_object(
+            content_key(name, data), data, "image/png", IMAGE_CACHE_CONTROL)
+
+    def publish(self, folder_name: str, images):
+        with images:
+            names = images.names()
+            with ThreadPoolExecutor(max_workers=max(1, min(S3_UPLOAD_WORKERS, len(names)))) as executor:
+                urls = executor.map(lambda name: self.upload(name, images.read(name)), names)
+                return dict(zip(names, urls))
+
+
+_host = None
+_host_lock = threading.Lock()
+
+
+def get_image_host():
+    """Returns the IMAGE_HOST the print files are stored in, creating it on first use."""
+    global _host
+    with _host_lock:
+        if _host is None:
+            if IMAGE_HOST == "github":
+                _host = GithubImageHost()
+            elif IMAGE_HOST == "local":
+                _host = LocalImageHost()
+            elif IMAGE_HOST == "s3":
+                _host = S3ImageHost()
+            else:
+                raise ValueError(f"Unknown IMAGE_HOST: {IMAGE_HOST}")
+        return _host
+
+
+def get_local_image_path(key: str):
+    """Returns the path of an image in the local store, None if the key is not a content addressed key."""
+    if not IMAGE_KEY_PATTERN.fullmatch(key):
+        return None
+    return store_path(IMAGE_STORE_DIR, key)
@@ -1,21 +1,215 @@
 """FastAPI server that handles patterns and ideas."""
 import os
-import json
+import asyncio
 import uuid
 from datetime import datetime
-from urllib.parse import quote
 
 from util.printify.printify_util import PrintifyUtil
+from util.printify.async_printify_util import AsyncPrintifyUtil
+from util.printify.shop_router import get_shop_router
+from util.printify.product_template import get_product_template
 from util.ai_util import AiUtil
-from util.image_util import create_text_image
-from util.github_util import GithubUploader
-from util.general_util import remove_surrounding_quotes
+from util.image_buffer import ImageBatch
+from util.general_util import is_near_duplicate, normalize_text, remove_surrounding_quotes
+from services.render_services import record_render_stats, render_text_image
+from services.archive_services import archive_images
+from services.hosting_services import get_image_host
 from res.models.objects import TshirtFromAiList
-from res.prompts.tshirt import user_message, blueprint_6_description
+from res.prompts.tshirt import user_message, blueprint_6_description, chunk_message, diversity_hints
+
+BLUEPRINT_ID = 6  # Unisex Gildan T-Shirt
+PRINT_PROVIDER_ID = 99  # Printify Choice Provider
+
+# "contents" sends the image bytes to Printify, "url" has Printify fetch them from the IMAGE_HOST
+PRINTIFY_UPLOAD_MODE = os.getenv("PRINTIFY_UPLOAD_MODE", "contents")
+# Whether images sent as contents are also archived to GitHub in the background
+GH_ARCHIVE = os.getenv("GH_ARCHIVE", "true").lower() == "true"
+
+# Larger batches of patterns are generated in parts of at most this many, in parallel
+AI_CHUNK_SIZE = int(os.getenv("AI_CHUNK_SIZE", "5"))
+# Parts generated at once
+AI_CHUNK_CONCURRENCY = int(os.getenv("AI_CHUNK_CONCURRENCY", "10"))
+# Patterns whose text is at least this alike to an earlier one are dropped
+AI_DEDUP_SIMILARITY = float(os.getenv("AI_DEDUP_SIMILARITY", "0.85"))
+
+
+def warm_printify_cache():
+    """Loads the store ID and the catalog data used by the pipeline into the Printify cache."""
+    printify = PrintifyUtil()
+    printify.get_all_variants(BLUEPRINT_ID, PRINT_PROVIDER_ID)
+
+
+async def create_printify_product(printify, router, template, pattern, uploads):
+    """Uploads the images of one pattern, then creates its product in the least loaded shop."""
+    image_ids = await asyncio.gather(*uploads)
+    if None in image_ids:
+        print(f"Skipping pattern {pattern.get('uuid')}: an image failed to upload")
+        return
+
+    # Create product in Printify
+    shop_id = await asyncio.to_thread(router.pick)
+    try:
+        product = await printify.create_product_from_template(
+            template,
+            title=pattern.get("product_name"),
+            description=pattern.get("description"),
+            marketing_tags=pattern.get("marketing_tags"),
+            image_ids=image_ids,
+            placement=pattern.get("placement"),
+            store_id=shop_id
+        )
+    finally:
+        router.release(shop_id)
+
+    # Add the product_id, image_ids and shop to the pattern
+    pattern.update({
+        "product_id": product,
+        "image_ids": image_ids,
+        "shop_id": shop_id
+    })
+
+
+def pattern_messages(number_of_patterns: int, idea: str):
+    """
+    Returns the messages of each completion generating the patterns of an
+    idea: one completion, or parts of at most AI_CHUNK_SIZE patterns, each
+    asked for a different angle so the parts do not repeat each other.
+    """
+    chunks = max(1, -(-number_of_patterns // AI_CHUNK_SIZE))
+    message_chunks = []
+    for chunk in range(chunks):
+        # Spread the patterns evenly over the parts
+        size = number_of_patterns // chunks + (1 if chunk < number_of_patterns % chunks else 0)
+        content = user_message % (size, idea) + blueprint_6_description
+        if chunks > 1:
+            content += chunk_message % diversity_hints[chunk % len(diversity_hints)]
+        message_chunks.append([
+            {"role": "system", "content": "You are a helpful chatbot"},
+            {"role": "user", "content": content},
+        ])
+    return message_chunks
+
+
+def render_job_of(pattern, text_colors):
+    """Returns the render job of a pattern: one image per text color from a single layout."""
+    return {
+        "text": pattern.get("tshirt_text"),
+        "height": 2000,
+        "width": 2000,
+        "colors": {
+            f"{pattern.get('uuid')}{color.get('hex')}.png": "#" + color.get("hex")
+            for color in text_colors
+        }
+    }
+
+
+async def process_pattern(printify, router, template, text_colors, folder_name, pattern):
+    """
+    Renders the images of one pattern, then creates its Printify product.
+    Returns:
+        dict: The render result of the pattern, see render_job.
+    """
+    # Generate a UUID for the pattern
+    pattern["uuid"] = str(uuid.uuid4())
+    pattern["tshirt_text"] = remove_surrounding_quotes(
+        pattern["tshirt_text"])
+
+    result = await render_text_image(render_job_of(pattern, text_colors))
+    if result.get("error") is not None:
+        print(f"Skipping pattern {pattern.get('uuid')}: {result.get('error')}")
+        return result
+    # Where the cropped images go on the shirt
+    pattern["placement"] = result.get("placement")
+
+    # The rendered images only live in memory until they are uploaded
+    images = ImageBatch()
+    for name, data in result.get("images").items():
+        images.add(name, data)
+    image_names = [f"{pattern.get('uuid')}{color.get('hex')}.png" for color in text_colors]
+
+    if PRINTIFY_UPLOAD_MODE == "url":
+        # Printify fetches the images from the image host, so they are stored first
+        urls = await asyncio.to_thread(get_image_host().publish, folder_name, images)
+        uploads = [printify.upload_image(urls[name]) for name in image_names]
+        await create_printify_product(printify, router, template, pattern, uploads)
+        return result
+
+    with images:
+        try:
+            # Send the image bytes to Printify
+            uploads = [printify.upload_image_contents(name, images.read(name)) for name in image_names]
+            await create_printify_product(printify, router, template, pattern, uploads)
+        finally:
+            if GH_ARCHIVE:
+                # The archive thread takes over the images and closes them,
+                # runs archived around the same time share a commit
+                archive_images(folder_name, images.detach())
+    return result
+
+
+async def generate_printify_products(ai, message_chunks, text_colors, variants, folder_name):
+    """
+    Streams the patterns of an idea from the AI and creates the Printify
+    product of each one as soon as it is generated, so rendering and
+    uploading run while the rest are still being generated. Patterns whose
+    text is nearly the same as an earlier one's are dropped.
+    Args:
+        ai (AiUtil): The AI the patterns are generated with.
+        message_chunks (list): The messages of each completion asking for patterns, see pattern_messages.
+        text_colors (list): The print areas, one per color with its "variant_ids".
+        variants (list): The variants of the products.
+        folder_name (str): The folder the images of this run are stored in.
+    Returns:
+        list: Every generated pattern, those that made it into a product have a "product_id".
+    """
+    patterns = []
+    tasks = []
+    async with ai, AsyncPrintifyUtil() as printify:
+        router = get_shop_router(printify.store_id)
+        # Every product of the batch shares the variants and print areas
+        template = get_product_template(BLUEPRINT_ID, PRINT_PROVIDER_ID, variants, text_colors)
+        try:
+            seen_texts = []
+            async for item in ai.astream_chunks(message_chunks, TshirtFromAiList, AI_CHUNK_CONCURRENCY):
+                pattern = item.model_dump()
+                text = normalize_text(pattern.get("tshirt_text"))
+                if is_near_duplicate(text, seen_texts, AI_DEDUP_SIMILARITY):
+                    print(f"Skipping a duplicate pattern: {pattern.get('tshirt_text')}")
+                    continue
+                seen_texts.append(text)
+                patterns.append(pattern)
+                tasks.append(asyncio.create_task(process_pattern(
+                    printify, router, template, text_colors, folder_name, pattern)))
+        except Exception as e:
+            # The patterns already generated still get their products
+            if not tasks:
+                raise
+            print(f"Streaming the patterns failed after {len(tasks)} of them: {e}")
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    record_render_stats([result for result in results if isinstance(result, dict)])
+    for pattern, result in zip(patterns, results):
+        # One failed pattern must not lose the products of the others
+        if isinstance(result, Exception):
+            print(f"Failed to create the product of pattern {pattern.get('uuid')}: {result}")
+        elif isinstance(result, BaseException):
+            raise result
+    return patterns
 
 
 # Function to process patterns and idea
-def process_patterns_and_idea(number_of_patterns: int, idea: str, publish: bool):
+def process_patterns_and_idea(number_of_patterns: int, idea: str, publish: bool, publish_queue=None):
+    """
+    Generates patterns for an idea, renders them and creates their Printify products.
+    Args:
+        publish (bool): Whether to queue the products for publishing.
+        publish_queue (PublishQueue, optional): The queue the products are published from, required to publish.
+    """
     text_colors = [
         {"hex": "000000", "shade": "dark"},
         {"hex": "FFFFFF", "shade": "light"}
@@ -26,8 +220,8 @@ def process_patterns_and_idea(number_of_patterns: int, idea: str, publish: bool)
 
     # Initialize and set up Printify
     printify = PrintifyUtil()
-    blueprint = 6  # Unisex Gildan T-Shirt
-    printer = 99  # Printify Choice Provider
+    blueprint = BLUEPRINT_ID
+    printer = PRINT_PROVIDER_ID
 
     # Collect Variants and sort them to light and dark
     variants, light_ids, dark_ids = printify.get_all_variants(
@@ -39,99 +233,30 @@ def process_patterns_and_idea(number_of_patterns: int, idea: str, publish: bool)
         else:
             color["variant_ids"] = light_ids
 
-    # Get patterns from AI
-    response = ai.chat(
-        messages=[
-            {"role": "system", "content": "You are a helpful chatbot"},
-            {"role": "user", "content": user_message %
-                (number_of_patterns, idea) + blueprint_6_description},
-        ],
-        output_model=TshirtFromAiList,
-    )
-
-    # Parse the response
-    parsed_response = json.loads(response)
-    patterns = parsed_response['patterns']
-
     # Get the current date and time
     current_time = datetime.now()
 
-    # Create images and push to GitHub
-    for pattern in patterns:
-        # Generate a UUID for the pattern
-        pattern["uuid"] = str(uuid.uuid4())
-        pattern["tshirt_text"] = remove_surrounding_quotes(
-            pattern["tshirt_text"])
-
-        # Format the date and time as a string
-        folder_name = f"./img/{current_time.strftime('%Y-%m-%d_%H-%M-%S')}"
-
-        # Create the directory if it doesn't exist
-        if not os.path.exists(folder_name):
-            os.makedirs(folder_name)
-
-        # Generate image for each color
-        for color in text_colors:
-            hex_value = color.get("hex")
-            create_text_image(
-                text=pattern.get("tshirt_text"),
-                height=2000,
-                width=2000,
-                file_name=f"{
-                    folder_name}/{pattern.get('uuid')}{hex_value}.png",
-                color="#" + hex_value
-            )
+    # Format the date and time as a string, the images are uploaded to this folder
+    folder_name = current_time.strftime('%Y-%m-%d_%H-%M-%S')
+
+    # Get patterns from AI in parallel parts, each one is rendered and sent to Printify as it arrives
+    patterns = asyncio.run(generate_printify_products(
+        ai,
+        message_chunks=pattern_messages(number_of_patterns, idea),
+        text_colors=text_colors,
+        variants=variants,
+        folder_name=folder_name
+    ))
 
     # Display the actual number of patterns generated
     print(f"\nNumber of Patterns generated: {len(patterns)}\n")
 
-    # Upload the images to GitHub
-    directory_with_images = f"{folder_name}/"
-    github_repository_url = os.getenv("GH_UPLOAD_REPO")
-    personal_access_token = os.getenv("GH_PAT")
-    print(directory_with_images, github_repository_url)
-    uploader = GithubUploader(
-        directory_with_images,
-        github_repository_url,
-        personal_access_token
-    )
-    uploader.upload()
-
-    # Send the images to Printify
-    url_prefix = os.getenv("GH_CONTENT_PREFIX")
-    for pattern in patterns:
-        # Upload image to Printify
-        for color in text_colors:
-            hex_value = color.get("hex")
-            image_url = f"{url_prefix}/{current_time.strftime('%Y-%m-%d_%H-%M-%S')}/{
-                quote(pattern.get('uuid'))}{hex_value}.png"
-            print("Image URL", image_url)
-            image_id = printify.upload_image(image_url)
-            # Append the image_id to the text color
-            color["image_id"] = image_id
-
-        # Create product in Printify
-        product = printify.create_product(
-            blueprint_id=blueprint,
-            print_provider_id=printer,
-            variants=variants,
-            title=pattern.get("product_name"),
-            description=pattern.get("description"),
-            marketing_tags=pattern.get("marketing_tags"),
-            text_colors=text_colors
-        )
-
-        # Add the product_id and image_ids to the pattern
-        pattern.update({
-            "product_id": product,
-            "image_ids": [color.get("image_id") for color in text_colors]
-        })
-
-        # Remove all images except the front image
-        printify.only_front_product_images_by_product_id(product)
-
-        # Publish the product if the publish flag is set
-        if publish:
-            printify.publish_product(product)
+    # Only the patterns that made it into a product are returned
+    patterns = [pattern for pattern in patterns if pattern.get("product_id")]
 
+    # The publish scheduler publishes them as the publish budget allows
+    if publish:
+        for pattern in patterns:
+            item = publish_queue.enqueue(pattern.get("product_id"), pattern.get("shop_id"))
+            pattern["publish_status"] = item.get("status")
     return patterns
@@ -0,0 +1,78 @@
+"""This file drains the publish queue at the rate the Printify publish budget allows."""
+import os
+import asyncio
+import time
+
+from util.printify.async_printify_util import AsyncPrintifyUtil
+from util.printify.printify_util import PrintifyError
+
+# Whether this process runs a publish scheduler, every replica may run one
+PUBLISH_SCHEDULER = os.getenv("PUBLISH_SCHEDULER", "true").lower() == "true"
+# Seconds between checks of an empty queue
+PUBLISH_POLL_INTERVAL = int(os.getenv("PUBLISH_POLL_INTERVAL", "10"))
+# Products looked up per check of the queue
+PUBLISH_BATCH_SIZE = 10
+
+
+async def publish_item(printify, queue, item: dict):
+    """
+    Trims a claimed product down to its front mockups and available variants,
+    then publishes it and records the outcome in the queue. Printify cannot
+    choose the mockups when a product is created, and publishing pushes them
+    to the storefront, so the trim is done right before.
+    """
+    product_id = item.get("product_id")
+    store_id = item.get("store_id")
+    try:
+        if await printify.repair_product(product_id, store_id=store_id) is None:
+            published, error = False, "Trimming the product before publishing failed"
+        else:
+            published = await printify.publish_product(product_id, store_id=store_id)
+            error = None if published else "Printify rejected the publish request"
+    except PrintifyError as e:
+        published, error = False, str(e)
+    if published:
+        await asyncio.to_thread(queue.succeed, product_id)
+    else:
+        item = await asyncio.to_thread(queue.fail, product_id, error)
+        print(f"Publishing {product_id} failed, attempt {item.get('attempts')}: {error}")
+
+
+async def drain_publish_queue(printify, queue):
+    """Publishes the products that are due, or waits a poll interval when there are none."""
+    product_ids = await asyncio.to_thread(queue.due, time.time(), PUBLISH_BATCH_SIZE)
+    if not product_ids:
+        await asyncio.sleep(PUBLISH_POLL_INTERVAL)
+        return
+    for product_id in product_ids:
+        # Another scheduler may have claimed it in the meantime
+        item = await asyncio.to_thread(queue.claim, product_id)
+        if item is not None:
+            await publish_item(printify, queue, item)
+
+
+async def run_publish_scheduler(queue):
+    """
+    Publishes the queued products until cancelled. Each publish waits for
+    the account's shared publish budget, so any number of schedulers
+    together never publish faster than Printify allows, and no request
+    waits on the budget.
+    """
+    print("Publish scheduler started.")
+    while True:
+        try:
+            async with AsyncPrintifyUtil() as printify:
+                while True:
+                    await drain_publish_queue(printify, queue)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Publish scheduler error: {e}")
+            await asyncio.sleep(PUBLISH_POLL_INTERVAL)
+
+
+def start_publish_scheduler(queue):
+    """Starts the publish scheduler on the running event loop, returns its task or None if disabled."""
+    if not PUBLISH_SCHEDULER:
+        return None
+    return asyncio.create_task(run_publish_scheduler(queue))
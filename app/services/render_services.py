@@ -0,0 +1,121 @@
+"""This file spreads the rendering of print images across a pool of processes."""
+import os
+import asyncio
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from util.image_util import encode_print_images
+
+# Number of rendering processes, 1 renders on the calling thread
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Render cache counters of the whole pool, counted from the job results
+render_stats = {"jobs": 0, "cache_hits": 0}
+_stats_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Returns the process pool shared by all requests, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn instead of fork, the parent holds gRPC and HTTP client threads
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            print(f"Render pool started with {RENDER_WORKERS} workers.")
+        return _pool
+
+
+def shutdown_render_pool(pool: ProcessPoolExecutor = None):
+    """
+    Stops the rendering processes, if they were started.
+    Args:
+        pool (ProcessPoolExecutor, optional): Only stop the pool if it is
+            still this one, so a late failure of a broken pool does not stop
+            the fresh pool that replaced it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and (pool is None or pool is _pool):
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def render_job(job: dict):
+    """
+    Renders a single job and reports the outcome instead of raising.
+    Args:
+        job (dict): The keyword arguments of encode_print_images.
+    Returns:
+        dict: The PNG bytes of the "images" by name, their "placement",
+            whether they came from the render cache and an "error" message,
+            which is None when the job succeeded.
+    """
+    try:
+        result = encode_print_images(**job)
+    except Exception as e:
+        traceback.print_exc()
+        return {"images": None, "placement": None, "cached": False, "error": str(e)}
+    if result is None:
+        return {"images": None, "placement": None, "cached": False, "error": "Rendering failed, see the render logs"}
+    return {**result, "error": None}
+
+
+async def render_text_image(job: dict):
+    """
+    Renders a single job on the render pool without blocking the event loop,
+    so jobs can start one by one as their inputs arrive. The caller adds the
+    results to the counters with record_render_stats.
+    Args:
+        job (dict): The keyword arguments of encode_print_images.
+    Returns:
+        dict: The result of render_job.
+    """
+    if RENDER_WORKERS <= 1:
+        return await asyncio.to_thread(render_job, job)
+    pool = get_render_pool()
+    try:
+        return await asyncio.wrap_future(pool.submit(render_job, job))
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+        # The pool was shut down with the job still waiting in it
+        print("Render job cancelled by a pool shutdown.")
+        return {"images": None, "placement": None, "cached": False, "error": "Render job cancelled"}
+    except Exception as e:
+        # The worker process died before it could report back
+        print(f"Render worker failed: {e}")
+        if isinstance(e, BrokenProcessPool):
+            # Start a fresh pool for the next jobs
+            shutdown_render_pool(pool)
+        return {"images": None, "placement": None, "cached": False, "error": str(e)}
+
+
+def get_render_stats():
+    """Returns the render cache counters of the whole pool since startup, with their hit rate."""
+    with _stats_lock:
+        return {
+            **render_stats,
+            "hit_rate": render_stats["cache_hits"] / render_stats["jobs"] if render_stats["jobs"] else 0.0
+        }
+
+
+def record_render_stats(results: list):
+    """Adds a batch to the render cache counters and logs its hit rate."""
+    hits = sum(1 for result in results if result.get("cached"))
+    with _stats_lock:
+        render_stats["jobs"] += len(results)
+        render_stats["cache_hits"] += hits
+        total_rate = render_stats["cache_hits"] / max(render_stats["jobs"], 1)
+    if results:
+        print(f"Render cache: {hits}/{len(results)} jobs served from cache "
+              f"({hits / len(results):.0%}), {total_rate:.0%} since startup.")
+    return results
@@ -1,11 +1,95 @@
 """This is a utility class for interacting with the OpenAI API to generate chat completions."""
 from os import getenv
 from typing import Optional
-from typing import Type
+from typing import Type, get_args
+import asyncio
+import json
+import threading
 
-from requests import get
-from openai import OpenAI
-from pydantic import BaseModel
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from pydantic import BaseModel, ValidationError
+
+# Connection pool and timeouts shared by every completion of the process
+OPENAI_MAX_CONNECTIONS = int(getenv("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE = int(getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_CONNECT_TIMEOUT = float(getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(getenv("OPENAI_READ_TIMEOUT", "120"))
+OPENAI_MAX_RETRIES = int(getenv("OPENAI_MAX_RETRIES", "2"))
+# Seconds the status check waits for the API
+STATUS_CHECK_TIMEOUT = 10
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def openai_client_options():
+    """Returns the pool limits and timeouts of the OpenAI clients."""
+    return {
+        "limits": httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE
+        ),
+        "timeout": httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    }
+
+
+def get_openai_client(api_key: str):
+    """Returns the OpenAI client of an API key, shared by the whole process and created on first use."""
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = OpenAI(
+                api_key=api_key,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultHttpxClient(**openai_client_options())
+            )
+        return _clients[api_key]
+
+
+class StreamedListParser:
+    """
+    Picks the complete items out of a JSON object that arrives in pieces,
+    such as {"patterns": [{...}, {...}]}: every object directly inside a
+    list of the top-level object is returned as soon as it closes.
+    """
+
+    def __init__(self):
+        # The open objects and lists, as their opening characters
+        self.containers = []
+        self.in_string = False
+        self.escaped = False
+        # The characters of the item being read, None between items
+        self.item = None
+
+    def feed(self, text: str):
+        """
+        Reads the next piece of the JSON text.
+        Returns:
+            list: The items completed by this piece, as decoded JSON.
+        """
+        items = []
+        for char in text:
+            if self.item is not None:
+                self.item.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if char == "{" and self.containers == ["{", "["]:
+                    self.item = [char]
+                self.containers.append(char)
+            elif char in "}]":
+                self.containers.pop()
+                if char == "}" and self.item is not None and self.containers == ["{", "["]:
+                    items.append(json.loads("".join(self.item)))
+                    self.item = None
+        return items
 
 
 class AiUtil:
@@ -28,6 +112,16 @@ class AiUtil:
                 output_model (Type[BaseModel]): The model to use for formatting the response.
             Returns:
                 str: The content of the first message choice from the completion.
+        achat(self, messages: list, output_model: Type[BaseModel]):
+            The same as chat, awaited on the event loop instead of blocking a thread.
+        astream_items(self, messages: list, output_model: Type[BaseModel]):
+            Streams the completion and yields each item of its list as soon as it is complete.
+        astream_chunks(self, message_chunks: list, output_model: Type[BaseModel], concurrency: int = None):
+            Streams several completions at once and yields the items of all of them as they complete.
+    The instances share one pooled client per API key, creating them is cheap.
+    The async methods need "async with AiUtil() as ai:", which opens a client
+    for the event loop and closes it at the end, as its connections cannot
+    be used by another loop.
     """
 
     def __init__(
@@ -38,14 +132,37 @@ class AiUtil:
             max_response_len: Optional[int] = None,
             frequency_penalty: float = 0
     ):
-        if not api_key:
-            self.api_key = getenv("OPENAI_API_KEY")
+        self.api_key = api_key or getenv("OPENAI_API_KEY")
         self.model = model
         self.temperature = temperature
         self.max_response_len = max_response_len
-        self.client = OpenAI()
+        self.client = get_openai_client(self.api_key)
+        self.async_client = None
         self.frequency_penalty = frequency_penalty
 
+    async def __aenter__(self):
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(**openai_client_options())
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.async_client.close()
+        self.async_client = None
+
+    def completion_options(self, messages: list, output_model: Type[BaseModel]):
+        """Returns the arguments of a completion request."""
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": self.max_response_len,
+            "frequency_penalty": self.frequency_penalty,
+            "response_format": output_model
+        }
+
     def chat(self, messages: list, output_model: Type[BaseModel]):
         """
         Sends a list of messages to the chat model and returns the response.
@@ -55,28 +172,108 @@ class AiUtil:
         Returns:
             str: The content of the response message.
         """
-
         completion = self.client.beta.chat.completions.parse(
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-            max_tokens=self.max_response_len,
-            frequency_penalty=self.frequency_penalty,
-            response_format=output_model
-        )
+            **self.completion_options(messages, output_model))
         return completion.choices[0].message.content
 
+    async def achat(self, messages: list, output_model: Type[BaseModel]):
+        """
+        Sends a list of messages to the chat model and returns the response,
+        without blocking the event loop.
+        Args:
+            messages (list): A list of messages to be sent to the chat model.
+            output_model (Type[BaseModel]): The pydantic model type for the response format.
+        Returns:
+            str: The content of the response message.
+        """
+        completion = await self.async_client.beta.chat.completions.parse(
+            **self.completion_options(messages, output_model))
+        return completion.choices[0].message.content
+
+    async def astream_items(self, messages: list, output_model: Type[BaseModel]):
+        """
+        Streams a completion whose output model holds a single list, and yields
+        each item of the list as soon as the model has finished writing it,
+        so the items can be used while the rest are still being generated.
+        Args:
+            messages (list): A list of messages to be sent to the chat model.
+            output_model (Type[BaseModel]): The pydantic model type for the
+                response format, with one list field, such as TshirtFromAiList.
+        Yields:
+            BaseModel: Each item of the list, as the item model of the list.
+                Items that do not match it are skipped.
+        """
+        list_field = next(iter(output_model.model_fields.values()))
+        item_model = get_args(list_field.annotation)[0]
+        parser = StreamedListParser()
+        async with self.async_client.beta.chat.completions.stream(
+                **self.completion_options(messages, output_model)) as stream:
+            async for event in stream:
+                if event.type != "content.delta":
+                    continue
+                for item in parser.feed(event.delta):
+                    try:
+                        yield item_model.model_validate(item)
+                    except ValidationError as e:
+                        print(f"Skipping an item that does not match {item_model.__name__}: {e}")
+
+    async def astream_chunks(self, message_chunks: list, output_model: Type[BaseModel], concurrency: int = None):
+        """
+        Streams several completions at once, such as the parts of a large
+        batch, and yields the items of all of them in the order they complete,
+        see astream_items. A failed completion only loses its own items.
+        Args:
+            message_chunks (list): The messages of each completion.
+            output_model (Type[BaseModel]): The pydantic model type for the
+                response format, with one list field.
+            concurrency (int, optional): The completions streamed at once, all of them by default.
+        Yields:
+            BaseModel: Each item of the lists.
+        Raises:
+            Exception: The error of the first failed completion, when no item was yielded at all.
+        """
+        queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(concurrency or max(1, len(message_chunks)))
+        # Put in the queue when a completion is over
+        finished = object()
+        errors = []
+        yielded = 0
+
+        async def stream_chunk(messages):
+            try:
+                async with semaphore:
+                    async for item in self.astream_items(messages, output_model):
+                        await queue.put(item)
+            except Exception as e:
+                print(f"A completion of the batch failed: {e}")
+                errors.append(e)
+            finally:
+                queue.put_nowait(finished)
+
+        tasks = [asyncio.create_task(stream_chunk(messages)) for messages in message_chunks]
+        try:
+            running = len(tasks)
+            while running:
+                item = await queue.get()
+                if item is finished:
+                    running -= 1
+                    continue
+                yielded += 1
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if errors and not yielded:
+            raise errors[0]
+
     def status_check(self):
         """
         Checks the status of the OpenAI API.
         Returns:
             str: The status of the OpenAI API.
         """
-        get(
-            "https://api.openai.com/v1/models",
-            headers={"Authorization": f"Bearer {self.api_key}"},
-            timeout=10
-        ).raise_for_status()
+        self.client.with_options(timeout=STATUS_CHECK_TIMEOUT, max_retries=0).models.list()
         return "OK"
 
 
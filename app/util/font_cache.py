@@ -0,0 +1,79 @@
+"""
+This is a utility module that keeps loaded fonts in memory for the whole process.
+The caches are functools.lru_cache instances, which are safe to share between threads.
+"""
+import os
+from functools import lru_cache
+
+from PIL import ImageFont
+
+# Maximum number of (font path, size) pairs kept loaded
+FONT_CACHE_SIZE = int(os.getenv("FONT_CACHE_SIZE", "256"))
+
+
+def find_font():
+    """Returns the path of a font that exists on the system, or None to use PIL's default font."""
+    possible_fonts = [
+        # Common fonts on Mac
+        "/Library/Fonts/Arial.ttf",
+        "/System/Library/Fonts/Supplemental/Arial.ttf",
+        "/Library/Fonts/Helvetica.ttf",
+        "/System/Library/Fonts/Supplemental/Helvetica.ttf",
+        "/Library/Fonts/Times New Roman.ttf",
+        # Common fonts on Windows
+        "C:\\Windows\\Fonts\\Arial.ttf",
+        "C:\\Windows\\Fonts\\times.ttf",
+        "C:\\Windows\\Fonts\\verdana.ttf",
+        # Common fonts on Linux
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        # PIL default font
+        "arial.ttf",
+        "DejaVuSans.ttf",  # Comes with matplotlib
+    ]
+    for font_path in possible_fonts:
+        if os.path.exists(font_path):
+            return font_path
+    # If none of the above fonts exist, use PIL's default font
+    return None
+
+
+@lru_cache(maxsize=1)
+def resolve_font_path():
+    """Returns the result of find_font, probing the file system only once per process."""
+    return find_font()
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(font_path, size: int):
+    """
+    Returns the font loaded at the given size, parsing the font file only the
+    first time a (font_path, size) pair is requested. The least recently used
+    fonts are dropped once FONT_CACHE_SIZE fonts are loaded.
+    Args:
+        font_path (str): The TrueType font file, or None for PIL's default font.
+        size (int): The font size in pixels.
+    Returns:
+        ImageFont.FreeTypeFont: The loaded font. Fonts are shared, so callers
+            must not modify them.
+    """
+    if font_path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(font_path, size=size)
+
+
+def font_cache_stats():
+    """Returns the hit and miss counters of the font cache."""
+    info = get_font.cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "font_path": resolve_font_path()
+    }
+
+
+def clear_font_cache():
+    """Drops every loaded font and the resolved font path."""
+    get_font.cache_clear()
+    resolve_font_path.cache_clear()
@@ -1,4 +1,6 @@
 """General utility functions."""
+import re
+from difflib import SequenceMatcher
 
 
 def remove_surrounding_quotes(s):
@@ -8,3 +10,16 @@ def remove_surrounding_quotes(s):
     if s.startswith('\\"') and s.endswith('\\"'):
         return s[2:-2]
     return s
+
+
+def normalize_text(s):
+    """normalize_text lowercases a string and drops its punctuation and extra whitespace, for comparing texts."""
+    return " ".join(re.sub(r"[^\w\s]", " ", s.lower()).split())
+
+
+def is_near_duplicate(s, others, similarity=0.85):
+    """is_near_duplicate returns whether a normalized string is at least similarity alike to any of the others."""
+    return any(
+        s == other or SequenceMatcher(None, s, other).ratio() >= similarity
+        for other in others
+    )
@@ -1,10 +1,27 @@
 """This module provides a utility class for uploading files to a Github repository."""
 import os
+import base64
 import datetime
 import re
 import shutil
-from github import Github
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from github import Github, GithubException, InputGitTreeElement
 from git import Repo
+from requests.exceptions import RequestException
+
+# "api" commits the files straight to main through the GitHub API, "clone"
+# pushes them from a local clone through a pull request
+GH_UPLOAD_MODE = os.getenv("GH_UPLOAD_MODE", "api")
+# Files uploaded to GitHub at once in api mode
+GH_BLOB_WORKERS = int(os.getenv("GH_BLOB_WORKERS", "8"))
+# Attempts at moving main when other commits land while committing
+GH_COMMIT_RETRIES = 3
+MAIN_BRANCH = 'main'
+
+# Uploads through the clone take turns, they share its working copy
+_clone_lock = threading.RLock()
+COMMIT_MESSAGE = 'Automated commit of new images'
 
 
 class GithubUploader:
@@ -26,12 +43,10 @@ class GithubUploader:
 
         self.repo_dir = os.path.join(os.getcwd(), self.repo_name)
 
-        # Check if repo directory exists
-        if not os.path.isdir(self.repo_dir):
-            self.clone_repo()
-
-        # Initialize Repo object
-        self.repo = Repo(self.repo_dir)
+        # The local clone, only opened when uploading through it
+        self.repo = None
+        if GH_UPLOAD_MODE == "clone":
+            self.open_repo()
 
         # Initialize Github instance
         self.g = Github(self.access_token)
@@ -40,80 +55,220 @@ class GithubUploader:
         self.github_repo = self.g.get_repo(f'{self.owner}/{self.repo_name}')
 
     def clone_repo(self):
-        """Clone the repository to the local directory."""
+        """
+        Clone the repository to the local directory. The clone is shallow,
+        of main only, and sparse, so it holds the latest commit of main
+        without the files of the earlier uploads however large the
+        repository grows.
+        """
         # Use the access token in the repo URL (Note: be cautious with token security)
         token_repo_url = self.repo_url.replace(
             'https://', f'https://{self.access_token}@')
-        Repo.clone_from(token_repo_url, self.repo_dir)
+        Repo.clone_from(
+            token_repo_url,
+            self.repo_dir,
+            depth=1,
+            branch=MAIN_BRANCH,
+            single_branch=True,
+            filter='blob:none',
+            sparse=True
+        )
 
-    def upload(self):
-        """Upload the files to the Github repository."""
-        # Create a new branch
-        branch_name = 'upload-' + datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    def open_repo(self):
+        """Returns the local clone of the repository, cloning it on first use."""
+        with _clone_lock:
+            if self.repo is None:
+                # Check if repo directory exists
+                if not os.path.isdir(self.repo_dir):
+                    self.clone_repo()
+                self.repo = Repo(self.repo_dir)
+            return self.repo
 
-        repo = self.repo
+    def sync_main(self):
+        """Moves main to the latest commit of the remote, fetching only that commit."""
+        with _clone_lock:
+            repo = self.open_repo()
+            repo.remotes.origin.fetch(
+                f'+refs/heads/{MAIN_BRANCH}:refs/remotes/origin/{MAIN_BRANCH}', depth=1)
+            # Drop whatever an earlier upload left behind
+            repo.git.checkout('-f', '-B', MAIN_BRANCH, f'origin/{MAIN_BRANCH}')
 
-        # Checkout main branch and pull latest changes
-        main_branch = 'main'
-        repo.git.checkout(main_branch)
-        repo.remotes.origin.pull()
+    def warm(self):
+        """Clones the repository, or brings an existing clone up to date, ahead of the first upload."""
+        self.sync_main()
 
-        # Create new branch
-        new_branch = repo.create_head(branch_name)
-        new_branch.checkout()
+    def upload(self, images=None):
+        """
+        Upload the files to the Github repository, in one commit on main
+        through the API, or through a clone when GH_UPLOAD_MODE is "clone"
+        or the API commit fails.
+        Args:
+            images (ImageBatch, optional): Images to write straight into the
+                directory of the repository. When None, the local directory
+                is copied into the repository instead.
+        Returns:
+            str: The SHA of the commit made through the API, None otherwise.
+        """
+        return self.upload_folders([(self.directory, images)])
 
-        # Copy the entire directory into the repo_dir
-        directory_name = os.path.basename(os.path.normpath(self.directory))
-        dst_dir = os.path.join(self.repo_dir, directory_name)
-
-        # If destination directory exists, remove it
-        if os.path.exists(dst_dir):
-            shutil.rmtree(dst_dir)
+    def upload_folders(self, folders):
+        """
+        Upload several folders to the Github repository in one commit, see upload.
+        Args:
+            folders (list): (directory, images) pairs, the directory names the
+                folder of the repository, images are written into it as in upload.
+        Returns:
+            str: The SHA of the commit made through the API, None otherwise.
+        """
+        if GH_UPLOAD_MODE == "api":
+            try:
+                return self.upload_with_api(folders)
+            except (GithubException, RequestException) as e:
+                print(f"GitHub API commit failed, uploading through a clone instead: {e}")
+        self.upload_with_clone(folders)
+        return None
 
-        shutil.copytree(self.directory, dst_dir)
+    def files(self, folders):
+        """Returns the path in the repository and the bytes of each file to upload."""
+        files = []
+        for directory, images in folders:
+            directory_name = os.path.basename(os.path.normpath(directory))
+            if images is not None:
+                files.extend((f'{directory_name}/{name}', images.read(name)) for name in images.names())
+                continue
+            for root, _, names in os.walk(directory):
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    relative_path = os.path.relpath(path, directory).replace(os.sep, '/')
+                    with open(path, 'rb') as file:
+                        files.append((f'{directory_name}/{relative_path}', file.read()))
+        return files
 
-        # Add all changes
-        repo.git.add(A=True)
+    def create_blob(self, data: bytes):
+        """Uploads the bytes of a file to the repository, returns the SHA of the blob."""
+        content = base64.b64encode(data).decode('ascii')
+        return self.github_repo.create_git_blob(content, 'base64').sha
 
-        # Check if there are changes to commit
-        if repo.is_dirty(untracked_files=True):
-            # Commit changes
-            commit_message = 'Automated commit of new images'
-            repo.index.commit(commit_message)
+    def upload_with_api(self, folders):
+        """
+        Commits the files to main through the Git Data API, without a local
+        clone: one blob per file, uploaded concurrently, then a single tree,
+        commit and update of main. Files already in the directory of the
+        repository are kept.
+        Args:
+            folders (list): See upload_folders.
+        Returns:
+            str: The SHA of the commit, None when there was nothing to commit.
+        """
+        files = self.files(folders)
+        if not files:
+            print('No changes to commit.')
+            return None
 
-            # Push new branch to remote
-            # Use the access token in the remote URL to authenticate
-            # Set up remote with token
-            origin = repo.remotes.origin
-            # Backup the original URL
-            original_url = origin.url
-            token_repo_url = self.repo_url.replace(
-                'https://', f'https://{self.access_token}@')
-            origin.set_url(token_repo_url)
+        with ThreadPoolExecutor(max_workers=min(GH_BLOB_WORKERS, len(files))) as executor:
+            blob_shas = list(executor.map(self.create_blob, [data for _, data in files]))
+        elements = [
+            InputGitTreeElement(path, '100644', 'blob', sha=blob_sha)
+            for (path, _), blob_sha in zip(files, blob_shas)
+        ]
 
+        for attempt in range(GH_COMMIT_RETRIES):
+            ref = self.github_repo.get_git_ref(f'heads/{MAIN_BRANCH}')
+            parent = self.github_repo.get_git_commit(ref.object.sha)
+            tree = self.github_repo.create_git_tree(elements, base_tree=parent.tree)
+            if tree.sha == parent.tree.sha:
+                print('No changes to commit.')
+                return None
+            commit = self.github_repo.create_git_commit(COMMIT_MESSAGE, tree, [parent])
             try:
-                origin.push(refspec=f'{branch_name}:{branch_name}')
-            finally:
-                # Reset the remote URL back to the original one
-                origin.set_url(original_url)
+                ref.edit(commit.sha)
+                return commit.sha
+            except GithubException as e:
+                # Main moved since it was read, build the tree again on top of it
+                if e.status != 422 or attempt == GH_COMMIT_RETRIES - 1:
+                    raise
+        return None
 
-            # Create pull request
-            pr_title = 'Automated PR - ' + branch_name
-            pr_body = 'This PR was automatically generated by GithubUploader.'
+    def upload_with_clone(self, folders):
+        """
+        Pushes the files from the local clone on a new branch, then opens a
+        pull request and merges it into main.
+        Args:
+            folders (list): See upload_folders.
+        """
+        with _clone_lock:
+            # Create a new branch
+            branch_name = 'upload-' + datetime.datetime.now().strftime('%Y%m%d%H%M%S')
 
-            pr = self.github_repo.create_pull(
-                title=pr_title, body=pr_body, head=branch_name, base=main_branch)
+            repo = self.open_repo()
 
-            # Merge the PR
-            pr.merge()
+            # Checkout main at its latest commit
+            self.sync_main()
 
-            # Checkout back to main
-            repo.git.checkout(main_branch)
+            # Create new branch
+            new_branch = repo.create_head(branch_name)
+            new_branch.checkout()
 
-            # Delete the branch locally
-            repo.git.branch('-D', branch_name)
+            # Copy the entire directories into the repo_dir
+            directory_names = [os.path.basename(os.path.normpath(directory)) for directory, _ in folders]
 
-            # Delete the branch remotely
-            origin.push(refspec=f':{branch_name}')
-        else:
-            print('No changes to commit.')
+            # Check out only the destination directories
+            repo.git.sparse_checkout('set', *sorted(set(directory_names)))
+
+            # If a destination directory exists, remove it
+            for directory_name in set(directory_names):
+                dst_dir = os.path.join(self.repo_dir, directory_name)
+                if os.path.exists(dst_dir):
+                    shutil.rmtree(dst_dir)
+
+            for (directory, images), directory_name in zip(folders, directory_names):
+                dst_dir = os.path.join(self.repo_dir, directory_name)
+                if images is not None:
+                    images.write_to(dst_dir)
+                else:
+                    shutil.copytree(directory, dst_dir, dirs_exist_ok=True)
+
+            # Add all changes
+            repo.git.add(A=True)
+
+            # Check if there are changes to commit
+            if repo.is_dirty(untracked_files=True):
+                # Commit changes
+                repo.index.commit(COMMIT_MESSAGE)
+
+                # Push new branch to remote
+                # Use the access token in the remote URL to authenticate
+                # Set up remote with token
+                origin = repo.remotes.origin
+                # Backup the original URL
+                original_url = origin.url
+                token_repo_url = self.repo_url.replace(
+                    'https://', f'https://{self.access_token}@')
+                origin.set_url(token_repo_url)
+
+                try:
+                    origin.push(refspec=f'{branch_name}:{branch_name}')
+                finally:
+                    # Reset the remote URL back to the original one
+                    origin.set_url(original_url)
+
+                # Create pull request
+                pr_title = 'Automated PR - ' + branch_name
+                pr_body = 'This PR was automatically generated by GithubUploader.'
+
+                pr = self.github_repo.create_pull(
+                    title=pr_title, body=pr_body, head=branch_name, base=MAIN_BRANCH)
+
+                # Merge the PR
+                pr.merge()
+
+                # Checkout back to main
+                repo.git.checkout(MAIN_BRANCH)
+
+                # Delete the branch locally
+                repo.git.branch('-D', branch_name)
+
+                # Delete the branch remotely
+                origin.push(refspec=f':{branch_name}')
+            else:
+                print('No changes to commit.')
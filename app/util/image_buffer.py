@@ -0,0 +1,73 @@
+"""This is a utility class for keeping the rendered images of a request in memory."""
+import os
+import tempfile
+
+# Images larger than this spill from memory to a temporary file
+IMAGE_SPOOL_MAX_MB = int(os.getenv("IMAGE_SPOOL_MAX_MB", "8"))
+
+
+class ImageBatch:
+    """
+    Holds the images of one pipeline run by name until they are uploaded.
+    Each image is a spooled temporary file, kept in memory unless it is
+    larger than IMAGE_SPOOL_MAX_MB. Closing the batch, or leaving its with
+    block, frees the memory and deletes any spilled files.
+    """
+
+    def __init__(self, spool_max_bytes: int = IMAGE_SPOOL_MAX_MB * 1024 * 1024):
+        self.spool_max_bytes = spool_max_bytes
+        self.buffers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def __contains__(self, name):
+        return name in self.buffers
+
+    def add(self, name: str, data: bytes):
+        """Stores the bytes of an image under a name, such as 'uuid000000.png'."""
+        if name in self.buffers:
+            self.buffers[name].close()
+        buffer = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        buffer.write(data)
+        self.buffers[name] = buffer
+
+    def read(self, name: str):
+        """Returns the bytes of an image."""
+        buffer = self.buffers[name]
+        buffer.seek(0)
+        return buffer.read()
+
+    def names(self):
+        """Returns the names of the images in the order they were added."""
+        return list(self.buffers)
+
+    def write_to(self, directory: str):
+        """Writes every image into a directory, returns the paths written."""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for name in self.buffers:
+            path = os.path.join(directory, name)
+            with open(path, "wb") as image_file:
+                image_file.write(self.read(name))
+            paths.append(path)
+        return paths
+
+    def detach(self):
+        """Moves the images into a new batch, which the caller must close, and leaves this batch empty."""
+        batch = ImageBatch(self.spool_max_bytes)
+        batch.buffers = self.buffers
+        self.buffers = {}
+        return batch
+
+    def close(self):
+        """Frees every image of the batch."""
+        for buffer in self.buffers.values():
+            buffer.close()
+        self.buffers = {}
@@ -1,199 +1,348 @@
 """This is a utility class for creating images with text using the Pillow library."""
+import io
 import os
 import traceback
-from PIL import Image, ImageDraw, ImageFont
-
-
-def get_text_width(font, text):
-    """Returns the width of the text when rendered with the given font."""
-    if hasattr(font, 'getlength'):
-        # For newer versions of Pillow
-        return font.getlength(text)
-    elif hasattr(font, 'getsize'):
-        # For older versions of Pillow
-        return font.getsize(text)[0]
-    elif hasattr(font, 'getbbox'):
-        # Alternative method
-        bbox = font.getbbox(text)
-        return bbox[2] - bbox[0]
-    else:
-        raise AttributeError(
-            "Font object has no method to calculate text width.")
+from PIL import Image, ImageDraw
 
+from util.font_cache import get_font, resolve_font_path
+from util.render_cache import get_render_cache
+from util.text_layout import (
+    LINE_SPACING_RATIO,
+    MAX_FONT_SIZE,
+    get_text_width,
+    layout_text
+)
 
-def create_text_image(text: str, height: int, width: int, file_name: str, color: str = "#000000"):
+# PNG settings for print files, optimize overrides the compress level with 9
+PRINT_PADDING = int(os.getenv("PRINT_PADDING", "40"))
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+PNG_OPTIMIZE = os.getenv("PNG_OPTIMIZE", "false").lower() == "true"
+# Fraction of the canvas size used to preview a layout
+PREVIEW_SCALE = float(os.getenv("PREVIEW_SCALE", "0.25"))
+
+
+def render_text_mask(text: str, height: int, width: int):
     """
-    Creates an image with the specified text centered within the given
-    dimensions and saves it as a PNG file.
+    Lays out the text centered within the given dimensions and draws it once
+    as an alpha mask that can be filled with any color.
     Args:
         text (str): The text to be displayed on the image.
         height (int): The height of the image in pixels.
         width (int): The width of the image in pixels.
-        file_name (str): The name of the file to save the image as,
-            including the file extension (e.g., 'image.png').
-        color (str, optional): The color of the text in hexadecimal
-            format (default is black, "#000000").
     Raises:
         ValueError: If the text cannot fit into the image at the minimum font size.
     Returns:
-        str: The file name if the image was created successfully, None otherwise.
+        Image: An "L" mode image where 255 is fully covered by text.
+    """
+    font_path = resolve_font_path()
+    if font_path is None:
+        # Use PIL's default font
+        print("Using PIL's default font.")
+    else:
+        print(f"Using font: {font_path}")
+
+    layout = layout_text(text, width, height, font_path)
+    if layout is None:
+        # Text does not fit even at the minimum font size
+        raise ValueError(
+            "Text cannot fit into the image at the minimum font size.")
+    best_font_size = layout.font_size
+    best_wrapped_text = layout.lines
+    best_total_height = layout.total_height
+
+    # Use the best font size
+    font = get_font(font_path, best_font_size)
+    ascent, descent = font.getmetrics()
+    line_spacing = int(best_font_size * LINE_SPACING_RATIO)
+
+    # Adjust total height to include the descent of the last line
+    best_total_height += descent
+
+    # Center position for the text
+    y_offset = (height - best_total_height) / 2
+
+    # Draw the text on the mask
+    mask = Image.new("L", (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    for line in best_wrapped_text:
+        # Get text width
+        text_width = get_text_width(font, line)
+        x = (width - text_width) / 2  # Center horizontally
+        draw.text((x, y_offset), line, fill=255, font=font)
+        y_offset += ascent + descent + line_spacing  # Move down for the next line
+    return mask
+
+
+def preview_text_image(text: str, height: int, width: int, scale: float = PREVIEW_SCALE):
+    """
+    Runs the layout of render_text_mask on a scaled down canvas to check how
+    the text would fit, without drawing or saving anything.
+    Args:
+        text (str): The text to be displayed on the image.
+        height (int): The height of the full size image in pixels.
+        width (int): The width of the full size image in pixels.
+        scale (float, optional): The fraction of the full size to lay out at.
+    Returns:
+        dict: Whether the text "fits", the estimated full size "font_size",
+            the "line_count" and the "fill_ratio", the share of the canvas
+            covered by the text block.
+    """
+    preview_width = max(1, round(width * scale))
+    preview_height = max(1, round(height * scale))
+    font_path = resolve_font_path()
+    layout = layout_text(
+        text,
+        preview_width,
+        preview_height,
+        font_path,
+        max_font_size=max(1, int(MAX_FONT_SIZE * scale))
+    )
+    # The text does not fit, or there is nothing to lay out, such as whitespace only
+    if layout is None or not layout.lines:
+        return {"fits": False, "font_size": 0, "line_count": 0, "fill_ratio": 0.0}
+
+    font = get_font(font_path, layout.font_size)
+    _, descent = font.getmetrics()
+    block_width = max(get_text_width(font, line) for line in layout.lines)
+    block_height = layout.total_height + descent
+    return {
+        "fits": True,
+        "font_size": round(layout.font_size / scale),
+        "line_count": len(layout.lines),
+        "fill_ratio": min(1.0, (block_width * block_height) / (preview_width * preview_height))
+    }
+
+
+def colorize_text_mask(mask, color: str):
+    """
+    Fills a text mask with a color on a transparent background. The result is
+    the same as drawing the text directly in that color.
+    Args:
+        mask (Image): The mask returned by render_text_mask.
+        color (str): The color of the text in hexadecimal format.
+    Returns:
+        Image: The "RGBA" image.
     """
+    image = Image.new("RGBA", mask.size, (255, 255, 255, 0))
+    bbox = mask.getbbox()
+    if bbox is not None:
+        # Only blend the area that is covered by text
+        ImageDraw.Draw(image).bitmap(bbox[:2], mask.crop(bbox), fill=color)
+    return image
+
 
-    # Ensure the output directory exists
-    output_dir = os.path.dirname(file_name)
-    if not os.path.exists(output_dir):
+def crop_text_mask(mask, padding: int = PRINT_PADDING):
+    """
+    Crops a text mask to the text plus padding. The same amount is cropped
+    from opposite sides, so the text keeps its position when the cropped
+    image is printed at the returned placement.
+    Args:
+        mask (Image): The mask returned by render_text_mask.
+        padding (int, optional): The transparent margin to keep around the text in pixels.
+    Returns:
+        tuple: The cropped mask and its placement on the print area, as the
+            "x" and "y" of its center and its "scale" relative to the full
+            image width.
+    """
+    width, height = mask.size
+    bbox = mask.getbbox()
+    if bbox is None:
+        return mask, {"x": 0.5, "y": 0.5, "scale": 1}
+    left, top, right, bottom = bbox
+    margin_x = max(0, min(left, width - right) - padding)
+    margin_y = max(0, min(top, height - bottom) - padding)
+    cropped = mask.crop(
+        (margin_x, margin_y, width - margin_x, height - margin_y))
+    placement = {
+        "x": 0.5,
+        "y": 0.5,
+        "scale": cropped.width / width
+    }
+    return cropped, placement
+
+
+def save_text_images(mask, file_colors: dict, compress_level: int = 6, optimize: bool = False):
+    """
+    Saves the mask filled with each color as a PNG file.
+    Args:
+        mask (Image): The mask returned by render_text_mask or crop_text_mask.
+        file_colors (dict): Maps each file name to the color of its text.
+        compress_level (int, optional): The zlib compression level, from 0
+            (fastest) to 9 (smallest). Default is Pillow's 6.
+        optimize (bool, optional): Whether to search for the smallest encoding.
+    Returns:
+        list: The file names if the images were saved successfully, None otherwise.
+    """
+    file_names = []
+    for file_name, color in file_colors.items():
         try:
-            os.makedirs(output_dir)
-            print(f"Output directory created: {output_dir}")
+            image = colorize_text_mask(mask, color)
+
+            # Save the image
+            image.save(file_name, "PNG",
+                       compress_level=compress_level, optimize=optimize)
+            print(f"Image saved successfully: {file_name}")
+            file_names.append(file_name)
+
         except Exception as e:
-            print(f"Failed to create output directory: {output_dir}")
+            print(f"Failed to create image '{file_name}': {e}")
             traceback.print_exc()
-            print(e)
             return None
+    return file_names
+
+
+def make_output_dirs(file_colors: dict):
+    """Creates the directories of the given file names, returns False if one could not be created."""
+    for output_dir in {os.path.dirname(file_name) for file_name in file_colors}:
+        if output_dir and not os.path.exists(output_dir):
+            try:
+                os.makedirs(output_dir)
+                print(f"Output directory created: {output_dir}")
+            except Exception as e:
+                print(f"Failed to create output directory: {output_dir}")
+                traceback.print_exc()
+                print(e)
+                return False
+    return True
+
+
+def create_text_images(text: str, height: int, width: int, file_colors: dict):
+    """
+    Creates one image per color with the specified text centered within the
+    given dimensions and saves them as PNG files. The text is laid out and
+    drawn once, only the fill differs between the files.
+    Args:
+        text (str): The text to be displayed on the images.
+        height (int): The height of the images in pixels.
+        width (int): The width of the images in pixels.
+        file_colors (dict): Maps each file name to save, including the file
+            extension (e.g., 'image.png'), to the color of its text in
+            hexadecimal format (e.g., "#000000").
+    Returns:
+        list: The file names if the images were created successfully, None otherwise.
+    """
+
+    # Ensure the output directories exist
+    if not make_output_dirs(file_colors):
+        return None
 
     try:
-        # Create a blank transparent image
-        image = Image.new("RGBA", (width, height), (255, 255, 255, 0))
-        draw = ImageDraw.Draw(image)
-
-        # Font parameters
-        min_font_size = 1
-        max_font_size = 500  # Set an upper limit for font size
-
-        best_font_size = min_font_size
-        best_wrapped_text = None
-        best_total_height = None
-
-        # Function to find a font that exists on the system
-        def find_font():
-            possible_fonts = [
-                # Common fonts on Mac
-                "/Library/Fonts/Arial.ttf",
-                "/System/Library/Fonts/Supplemental/Arial.ttf",
-                "/Library/Fonts/Helvetica.ttf",
-                "/System/Library/Fonts/Supplemental/Helvetica.ttf",
-                "/Library/Fonts/Times New Roman.ttf",
-                # Common fonts on Windows
-                "C:\\Windows\\Fonts\\Arial.ttf",
-                "C:\\Windows\\Fonts\\times.ttf",
-                "C:\\Windows\\Fonts\\verdana.ttf",
-                # Common fonts on Linux
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                # PIL default font
-                "arial.ttf",
-                "DejaVuSans.ttf",  # Comes with matplotlib
-            ]
-            for font_path in possible_fonts:
-                if os.path.exists(font_path):
-                    return font_path
-            # If none of the above fonts exist, use PIL's default font
-            return None
+        mask = render_text_mask(text, height, width)
+    except Exception as e:
+        print(f"Failed to create images for '{text}': {e}")
+        traceback.print_exc()
+        return None
 
-        font_path = find_font()
-        if font_path is None:
-            # Use PIL's default font
-            print("Using PIL's default font.")
-            font = ImageFont.load_default()
-        else:
-            print(f"Using font: {font_path}")
-            font = None  # We'll set the font in the loop
-
-        while min_font_size <= max_font_size:
-            font_size = (min_font_size + max_font_size) // 2
-            if font_path is None:
-                # Use default font
-                font = ImageFont.load_default()
-            else:
-                font = ImageFont.truetype(font_path, size=font_size)
-
-            fits, wrapped_text, total_height = does_text_fit(
-                draw, text, font, width, height)
-            if fits:
-                # This font size fits, try a bigger one
-                best_font_size = font_size
-                best_wrapped_text = wrapped_text
-                best_total_height = total_height
-                min_font_size = font_size + 1
-            else:
-                # Font size too big, try a smaller one
-                max_font_size = font_size - 1
-
-        if best_wrapped_text is None:
-            # Text does not fit even at the minimum font size
-            raise ValueError(
-                "Text cannot fit into the image at the minimum font size.")
-
-        # Use the best font size
-        if font_path is None:
-            # Use default font
-            font = ImageFont.load_default()
-        else:
-            font = ImageFont.truetype(font_path, size=best_font_size)
-        ascent, descent = font.getmetrics()
-        line_spacing = int(best_font_size * 0.2)  # 20% of font size
-
-        # Adjust total height to include the descent of the last line
-        best_total_height += descent
-
-        # Center position for the text
-        y_offset = (height - best_total_height) / 2
-
-        # Draw the text on the image
-        for line in best_wrapped_text:
-            # Get text width
-            text_width = get_text_width(font, line)
-            x = (width - text_width) / 2  # Center horizontally
-            draw.text((x, y_offset), line, fill=color, font=font)
-            y_offset += ascent + descent + line_spacing  # Move down for the next line
-
-        # Save the image
-        image.save(file_name, "PNG")
-        print(f"Image saved successfully: {file_name}")
-        return file_name
+    return save_text_images(mask, file_colors)
 
+
+def encode_print_images(
+        text: str,
+        height: int,
+        width: int,
+        colors: dict,
+        padding: int = PRINT_PADDING,
+        compress_level: int = PNG_COMPRESS_LEVEL,
+        optimize: bool = PNG_OPTIMIZE
+):
+    """
+    Creates one print file per color in memory, cropped to the text plus
+    padding and encoded with the given PNG settings. Most of a print canvas
+    is transparent, so the files are much smaller and faster to encode,
+    upload and fetch.
+    Args:
+        text (str): The text to be displayed on the images.
+        height (int): The height of the print canvas in pixels.
+        width (int): The width of the print canvas in pixels.
+        colors (dict): Maps the name of each image to the color of its text
+            in hexadecimal format.
+        padding (int, optional): The transparent margin to keep around the text in pixels.
+        compress_level (int, optional): The zlib compression level, from 0 to 9.
+        optimize (bool, optional): Whether to search for the smallest encoding.
+    Returns:
+        dict: The PNG bytes of each image by name as "images", the
+            "placement" that prints the cropped images where the full canvas
+            would have been and whether they were "cached" renders, or None
+            if the images could not be created.
+    """
+    # Reuse earlier renders of the same text when every color is cached
+    cache = get_render_cache()
+    cache_keys = {}
+    if cache is not None:
+        for name, color in colors.items():
+            cache_keys[name] = cache.key(
+                text=text,
+                font=resolve_font_path(),
+                height=height,
+                width=width,
+                color=color,
+                padding=padding,
+                compress_level=compress_level,
+                optimize=optimize
+            )
+        entries = {}
+        for name, key in cache_keys.items():
+            entry = cache.get(key)
+            if entry is None:
+                break
+            entries[name] = entry
+        if len(entries) == len(colors):
+            try:
+                images = {}
+                for name, entry in entries.items():
+                    with open(entry.get("path"), "rb") as image_file:
+                        images[name] = image_file.read()
+                print(f"Images served from the render cache: {list(images)}")
+                return {
+                    "images": images,
+                    "placement": entry.get("placement"),
+                    "cached": True
+                }
+            except OSError as e:
+                # Evicted while reading, render it again
+                print(f"Render cache entry unavailable: {e}")
+
+    try:
+        mask, placement = crop_text_mask(
+            render_text_mask(text, height, width), padding)
+        images = {}
+        for name, color in colors.items():
+            buffer = io.BytesIO()
+            colorize_text_mask(mask, color).save(
+                buffer, "PNG", compress_level=compress_level, optimize=optimize)
+            images[name] = buffer.getvalue()
     except Exception as e:
-        print(f"Failed to create image '{file_name}': {e}")
+        print(f"Failed to create images for '{text}': {e}")
         traceback.print_exc()
         return None
 
+    for name, key in cache_keys.items():
+        try:
+            cache.put(key, images[name], {"placement": placement})
+        except OSError as e:
+            print(f"Failed to add '{name}' to the render cache: {e}")
+    return {"images": images, "placement": placement, "cached": False}
+
 
-def does_text_fit(draw, text, font, width, height):
-    """Determines if the text fits within the specified width and height with the given font."""
-    ascent, descent = font.getmetrics()
-    line_spacing = int(font.size * 0.2)  # 20% of font size
-
-    # Wrap the text
-    wrapped_text = []
-    lines = text.splitlines()
-    for line in lines:
-        words = line.split()
-        current_line = ""
-        for word in words:
-            test_line = f"{current_line} {word}".strip()
-            # Get text width
-            text_width = get_text_width(font, test_line)
-            if text_width <= width:
-                current_line = test_line
-            else:
-                if not current_line:
-                    # Single word longer than width, cannot fit
-                    return False, None, None
-                wrapped_text.append(current_line)
-                current_line = word
-        if current_line:
-            wrapped_text.append(current_line)
-
-    # Calculate total height for the wrapped text
-    num_lines = len(wrapped_text)
-    total_height = (ascent + descent) * num_lines + \
-        line_spacing * (num_lines - 1)
-
-    # Check if any line exceeds width
-    any_line_too_wide = any(get_text_width(font, line) > width for line in wrapped_text)
-
-    # Return whether text fits, the wrapped_text, and total_height
-    fits = (total_height <= height) and not any_line_too_wide
-    return fits, wrapped_text, total_height
+def create_text_image(text: str, height: int, width: int, file_name: str, color: str = "#000000"):
+    """
+    Creates an image with the specified text centered within the given
+    dimensions and saves it as a PNG file.
+    Args:
+        text (str): The text to be displayed on the image.
+        height (int): The height of the image in pixels.
+        width (int): The width of the image in pixels.
+        file_name (str): The name of the file to save the image as,
+            including the file extension (e.g., 'image.png').
+        color (str, optional): The color of the text in hexadecimal
+            format (default is black, "#000000").
+    Returns:
+        str: The file name if the image was created successfully, None otherwise.
+    """
+    file_names = create_text_images(text, height, width, {file_name: color})
+    if file_names is None:
+        return None
+    return file_names[0]
 
 
 if __name__ == "__main__":
@@ -216,3 +365,15 @@ if __name__ == "__main__":
         print(f"Image created successfully: {result}")
     else:
         print("Image creation failed.")
+
+    # Both shirt colors from a single layout
+    results = create_text_images(
+        text,
+        height,
+        width,
+        {
+            "./img/Bug-Free Zone000000.png": "#000000",
+            "./img/Bug-Free ZoneFFFFFF.png": "#FFFFFF"
+        }
+    )
+    print(f"Images created: {results}")
@@ -0,0 +1,284 @@
+"""This is a utility class for creating a batch of Printify products concurrently."""
+import asyncio
+import base64
+from os import getenv
+
+import httpx
+
+from util.printify.printify_cache import printify_cache
+from util.printify.printify_util import (
+    PRINTIFY_POOL_SIZE,
+    PRINTIFY_CONNECT_TIMEOUT,
+    PRINTIFY_READ_TIMEOUT,
+    PRINTIFY_RETRIES,
+    PUBLISH_PROPERTIES,
+    PrintifyError,
+    build_product,
+    build_product_repair
+)
+from util.printify.rate_limit import (
+    PRINTIFY_THROTTLE_RETRIES,
+    get_rate_limiter,
+    retry_delay,
+    should_retry
+)
+
+
+class AsyncPrintifyUtil():
+    """
+    The asyncio counterpart of PrintifyUtil for the calls made per product.
+    Requests wait on the account's shared rate limits without sleeping the
+    thread, so a batch sends as fast as the rate limits allow.
+    Use it as an async context manager:
+
+        async with AsyncPrintifyUtil() as printify:
+            image_ids = await printify.upload_images(image_urls)
+    """
+
+    def __init__(self):
+        """This method initializes the variables required for the connection."""
+        self.API_KEY = getenv('PRINTIFY_API_KEY')
+        self.BASE_URL = "https://api.printify.com/v1"
+        self.store_id = None
+        self.headers = {
+            'Authorization': f'Bearer {self.API_KEY}'
+        }
+        self.client = None
+
+    async def __aenter__(self):
+        # Connection errors are retried by the transport, nothing was sent yet
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(PRINTIFY_READ_TIMEOUT, connect=PRINTIFY_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=PRINTIFY_POOL_SIZE,
+                max_keepalive_connections=PRINTIFY_POOL_SIZE
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=PRINTIFY_RETRIES)
+        )
+        # Every product request needs the shop, fail now rather than send them to shops/None
+        if await self.load_store_id() is None:
+            await self.client.aclose()
+            self.client = None
+            raise PrintifyError("Could not load the Printify store ID")
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.client.aclose()
+        self.client = None
+
+    async def request(self, method: str, path: str, budget: str = "general", store_id=None, **kwargs):
+        """
+        Sends a request once the rate limit budget of the account, and of the
+        shop store_id if given, allows it, retrying throttled and failed responses
+        like PrintifyUtil.request.
+        Returns:
+            httpx.Response: The response.
+        Raises:
+            PrintifyError: If the request is still throttled or failing after
+                PRINTIFY_THROTTLE_RETRIES, or cannot be sent at all.
+        """
+        limiter = get_rate_limiter(budget, store_id)
+        for attempt in range(PRINTIFY_THROTTLE_RETRIES + 1):
+            await limiter.acquire()
+            try:
+                response = await self.client.request(method, f"{self.BASE_URL}/{path}", **kwargs)
+            except httpx.HTTPError as e:
+                # Transport retries are done, so the pattern fails like any other Printify error
+                raise PrintifyError(f"{method} {path} failed: {e}") from e
+            if not should_retry(method, response.status_code):
+                await self.update_limiter(limiter.recover)
+                return response
+            delay = retry_delay(response.headers, attempt)
+            print(f"Printify returned {response.status_code} for {method} {path}, attempt {attempt + 1}.")
+            if response.status_code == 429:
+                # The next acquire waits out the pause
+                await self.update_limiter(limiter.throttle, delay)
+            else:
+                await asyncio.sleep(delay)
+        raise PrintifyError(
+            f"{method} {path} failed with status {response.status_code} after {attempt + 1} attempts",
+            response.status_code)
+
+    @staticmethod
+    async def update_limiter(update, *args):
+        """Calls a rate limiter update, off the event loop when its backend does I/O."""
+        if update.__self__.blocking:
+            return await asyncio.to_thread(update, *args)
+        return update(*args)
+
+    async def load_store_id(self):
+        """Sets self.store_id from the cache, fetching it from the Printify API only when it is not cached."""
+        shops = printify_cache.get("shops.json")
+        if not shops:
+            response = await self.request("GET", "shops.json")
+            if response.status_code != 200:
+                print(f"Failed to fetch stores. Status code: {response.status_code}")
+                return None
+            shops = response.json()
+            if not shops:
+                print("No stores found in the response.")
+                return None
+            printify_cache.set("shops.json", shops)
+        self.store_id = shops[0]['id']
+        return self.store_id
+
+    async def upload_image(self, image_url: str):
+        """Uploads an image to Printify and returns its ID."""
+        file_name = image_url.split("/")[-1]
+        data = {
+            "file_name": file_name,
+            "url": image_url
+        }
+        response = await self.request("POST", "uploads/images.json", json=data)
+        if response.status_code == 200:
+            print(f"Image uploaded successfully: {file_name}")
+            return response.json()['id']
+        print(f"Failed to upload image. Status code: {response.status_code}")
+        print(response.text)
+        return None
+
+    async def upload_image_contents(self, file_name: str, data: bytes):
+        """Uploads the bytes of an image to Printify and returns its ID."""
+        data = {
+            "file_name": file_name,
+            "contents": base64.b64encode(data).decode("ascii")
+        }
+        response = await self.request("POST", "uploads/images.json", json=data)
+        if response.status_code == 200:
+            print(f"Image uploaded successfully: {file_name}")
+            return response.json()['id']
+        print(f"Failed to upload image. Status code: {response.status_code}")
+        print(response.text)
+        return None
+
+    async def upload_images(self, image_urls: list):
+        """Uploads images concurrently, returns their IDs in the same order."""
+        return await asyncio.gather(*(self.upload_image(image_url) for image_url in image_urls))
+
+    async def create_product(self, store_id=None, **kwargs):
+        """
+        Creates a new product on Printify.
+        Args:
+            store_id (int, optional): The shop to create it in, the client's shop by default.
+            **kwargs: The arguments of PrintifyUtil.create_product.
+        Returns:
+            product_id (str): The ID of the created product. or None if the product creation failed.
+        """
+        store_id = store_id or self.store_id
+        product = build_product(**kwargs)
+        response = await self.request(
+            "POST", f"shops/{store_id}/products.json", store_id=store_id, json=product)
+        if response.status_code == 200:
+            print(f"Product created successfully: {response.json()['id']}")
+            return response.json()['id']
+        print(f"Failed to create product. Status code: {response.status_code}")
+        return None
+
+    async def create_product_from_template(
+            self,
+            template,
+            title,
+            description,
+            marketing_tags,
+            image_ids,
+            placement=None,
+            store_id=None
+    ):
+        """
+        Creates a new product on Printify from a pre-encoded ProductTemplate.
+        Args:
+            template (ProductTemplate): The blueprint, provider, variants and print areas of the product.
+            image_ids (list): The ID of the image of each print area of the template.
+            store_id (int, optional): The shop to create it in, the client's shop by default.
+            The other arguments are those of PrintifyUtil.create_product.
+        Returns:
+            product_id (str): The ID of the created product. or None if the product creation failed.
+        """
+        store_id = store_id or self.store_id
+        body = template.encode(title, description, marketing_tags, image_ids, placement)
+        response = await self.request(
+            "POST",
+            f"shops/{store_id}/products.json",
+            store_id=store_id,
+            content=body,
+            headers={"Content-Type": "application/json"}
+        )
+        if response.status_code == 200:
+            print(f"Product created successfully: {response.json()['id']}")
+            return response.json()['id']
+        print(f"Failed to create product. Status code: {response.status_code}")
+        return None
+
+    async def publish_product(self, product_id, store_id=None):
+        """Publishes a product in Printify, of the client's shop unless store_id is given."""
+        store_id = store_id or self.store_id
+        response = await self.request(
+            "POST",
+            f"shops/{store_id}/products/{product_id}/publish.json",
+            budget="publish",
+            store_id=store_id,
+            json=PUBLISH_PROPERTIES
+        )
+        if response.status_code == 200:
+            print(f"Product published: {product_id}")
+            return True
+        print(f"Failed to publish product. Status code: {response.status_code}")
+        return False
+
+    async def get_product_by_id(self, product_id, store_id=None):
+        """Fetches a product by ID from the Printify API."""
+        store_id = store_id or self.store_id
+        response = await self.request(
+            "GET", f"shops/{store_id}/products/{product_id}.json", store_id=store_id)
+        if response.status_code == 200:
+            return response.json()
+        print(f"Failed to fetch product. Status code: {response.status_code}")
+        return None
+
+    async def update_product_by_id(self, product_id, product, store_id=None):
+        """Updates a product by ID in Printify."""
+        store_id = store_id or self.store_id
+        response = await self.request(
+            "PUT", f"shops/{store_id}/products/{product_id}.json", store_id=store_id, json=product)
+        if response.status_code == 200:
+            print(f"Product updated successfully: {product_id}")
+            return True
+        print(f"Failed to update product. Status code: {response.status_code}")
+        print(response.text)
+        return False
+
+    async def repair_product(self, product_id, front_images_only=True, disable_unavailable=True, store_id=None):
+        """
+        Trims a product down to its front mockups and available variants,
+        see PrintifyUtil.repair_product.
+        Returns:
+            dict: The update sent, empty if the product needed none, or None if it failed.
+        """
+        product = await self.get_product_by_id(product_id, store_id)
+        if product is None:
+            return None
+        update = build_product_repair(product, front_images_only, disable_unavailable)
+        if update and not await self.update_product_by_id(product_id, update, store_id):
+            return None
+        return update
+
+    async def repair_products(self, product_ids: list, front_images_only=True, disable_unavailable=True, store_id=None):
+        """
+        Repairs a batch of products concurrently.
+        Returns:
+            dict: "repaired", "unchanged" or "failed" by product ID.
+        """
+        updates = await asyncio.gather(*(
+            self.repair_product(product_id, front_images_only, disable_unavailable, store_id)
+            for product_id in product_ids
+        ), return_exceptions=True)
+        results = {}
+        for product_id, update in zip(product_ids, updates):
+            if isinstance(update, PrintifyError) or update is None:
+                results[product_id] = "failed"
+            elif isinstance(update, BaseException):
+                raise update
+            else:
+                results[product_id] = "repaired" if update else "unchanged"
+        return results
@@ -0,0 +1,98 @@
+"""This is a utility class for caching rarely changing Printify data, such as the catalog."""
+import os
+import json
+import time
+import threading
+
+# Seconds before cached catalog data is fetched again
+PRINTIFY_CACHE_TTL = int(os.getenv("PRINTIFY_CACHE_TTL", "86400"))
+# File the cache is kept in across restarts, empty to keep it in memory only
+PRINTIFY_CACHE_FILE = os.getenv("PRINTIFY_CACHE_FILE", "./printify_cache.json")
+
+
+class PrintifyCache:
+    """
+    A thread-safe cache of Printify API responses by path, such as
+    'shops.json' or 'catalog/blueprints/6/print_providers/99/variants.json'.
+    Entries expire after ttl seconds and are written to file_path, so a
+    restarted process starts warm. Processes sharing the file reload it when
+    another process changes it.
+    """
+
+    def __init__(self, ttl: int = PRINTIFY_CACHE_TTL, file_path: str = PRINTIFY_CACHE_FILE):
+        self.ttl = ttl
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.file_mtime = None
+        self.load()
+
+    def load(self):
+        """Loads the entries persisted by an earlier or another process."""
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+        try:
+            file_mtime = os.path.getmtime(self.file_path)
+            with open(self.file_path, "r", encoding="utf-8") as cache_file:
+                entries = json.load(cache_file)
+            with self.lock:
+                self.entries = entries
+                self.file_mtime = file_mtime
+            print(f"Loaded {len(entries)} Printify cache entries from {self.file_path}")
+        except (OSError, ValueError) as e:
+            print(f"Failed to load the Printify cache: {e}")
+
+    def refresh(self):
+        """Reloads the cache file if another process has written it since it was last read."""
+        if not self.file_path:
+            return
+        try:
+            file_mtime = os.path.getmtime(self.file_path)
+        except OSError:
+            return
+        if file_mtime != self.file_mtime:
+            self.load()
+
+    def save(self):
+        """Writes the entries to the cache file."""
+        if not self.file_path:
+            return
+        with self.lock:
+            encoded = json.dumps(self.entries)
+        temp_path = f"{self.file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as cache_file:
+                cache_file.write(encoded)
+            os.replace(temp_path, self.file_path)
+            self.file_mtime = os.path.getmtime(self.file_path)
+        except OSError as e:
+            print(f"Failed to save the Printify cache: {e}")
+
+    def get(self, path: str):
+        """Returns the cached response for a path, or None if it is missing or expired."""
+        self.refresh()
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is None or entry["expires"] < time.time():
+            return None
+        return entry["data"]
+
+    def set(self, path: str, data):
+        """Caches the response for a path."""
+        self.refresh()
+        with self.lock:
+            self.entries[path] = {"expires": time.time() + self.ttl, "data": data}
+        self.save()
+
+    def invalidate(self, prefix: str = ""):
+        """Removes the entries whose path starts with prefix, all of them by default. Returns the count removed."""
+        self.refresh()
+        with self.lock:
+            paths = [path for path in self.entries if path.startswith(prefix)]
+            for path in paths:
+                del self.entries[path]
+        self.save()
+        return len(paths)
+
+
+printify_cache = PrintifyCache()
@@ -1,19 +1,242 @@
 """This is a utility class for listing and creating products in Printify."""
 from os import getenv
+import base64
 import random
+import threading
 import time
 
 import requests
-from ratelimit import limits, sleep_and_retry
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from util.printify.printify_cache import printify_cache
+from util.printify.rate_limit import (
+    PRINTIFY_THROTTLE_RETRIES,
+    get_rate_limiter,
+    retry_delay,
+    should_retry
+)
 
 current_time = int(time.time())
 random.seed(current_time)
 
-# Prinitify Rate Limits
-PRINTIFY_RATE_LIMIT = 600
-PRINTIFY_RATE_PERIOD = 60  # 1 minute
-PUBLISH_RATE_LIMIT = 200
-PUBLISH_RATE_PERIOD = 1800  # 30 minutes
+# Connection pool shared by every PrintifyUtil in the process
+PRINTIFY_POOL_SIZE = int(getenv("PRINTIFY_POOL_SIZE", "10"))
+PRINTIFY_CONNECT_TIMEOUT = float(getenv("PRINTIFY_CONNECT_TIMEOUT", "5"))
+PRINTIFY_READ_TIMEOUT = float(getenv("PRINTIFY_READ_TIMEOUT", "60"))
+# Retries of idempotent requests on connection errors, responses are retried by request
+PRINTIFY_RETRIES = int(getenv("PRINTIFY_RETRIES", "3"))
+
+# Properties of a product that are pushed to the sales channel on publish
+PUBLISH_PROPERTIES = {
+    "title": True,
+    "description": True,
+    "images": True,
+    "variants": True,
+    "tags": True
+}
+
+# The shirt colors products are offered in
+SUPPORTED_COLORS = [
+    "Black",
+    "White",
+    "Cardinal Red",
+    "Carolina Blue",
+    "Sport Grey",
+    "Red",
+    "Light Pink",
+    "Navy",
+    "Sapphire",
+    "Sunset",
+    "Turf Green",
+    "Military Green",
+    "Heliconia",
+    "Charcoal",
+    "Purple",
+    "Heather Sapphire"
+]
+# Colors that get the dark print, all others get the light print
+LIGHT_COLORS = ["White", "Sport Grey"]
+# Sizes sold at the typical price, all others are extended sizes
+TYPICAL_SIZES = ["XS", "S", "M", "L", "XL", "2XL"]
+
+# Variant indexes by catalog path, with the catalog they were built from
+_variant_indexes = {}
+
+
+class PrintifyError(Exception):
+    """Raised when Printify keeps throttling or failing a request after every retry."""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_printify_session():
+    """Returns the keep-alive session shared by every PrintifyUtil, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=PRINTIFY_RETRIES,
+                backoff_factor=0.5,
+                # POST is not idempotent, a retried upload or create could duplicate it
+                allowed_methods=["GET", "PUT", "HEAD", "OPTIONS"],
+                # Connection errors only, 429 and 5xx responses are retried by
+                # request, which throttles the shared rate limit
+                status=0,
+                respect_retry_after_header=False,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=PRINTIFY_POOL_SIZE,
+                max_retries=retry
+            )
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+        return _session
+
+
+def build_variant_index(catalog, typical_size_price, extended_size_price):
+    """
+    Indexes the variants of a catalog in the supported colors by (color, size).
+    Typical sizes are enabled at the typical price, extended sizes are
+    listed at the extended price but disabled.
+    Returns:
+        dict: {"id", "price", "is_enabled"} by (color, size), in catalog order.
+    """
+    index = {}
+    for variant in catalog['variants']:
+        color = variant['options'].get('color')
+        size = variant['options']['size']
+        # Don't allow colors that are outside of the supported colors
+        if color not in SUPPORTED_COLORS:
+            continue
+        typical = size in TYPICAL_SIZES
+        index[(color, size)] = {
+            "id": variant['id'],
+            "price": typical_size_price if typical else extended_size_price,
+            "is_enabled": typical
+        }
+    return index
+
+
+def build_product(
+        blueprint_id,
+        print_provider_id,
+        variants,
+        title,
+        description,
+        marketing_tags,
+        text_colors=None,
+        image_id=None,
+        placement=None,
+):
+    """
+    Builds the body of a create product request, see PrintifyUtil.create_product for the arguments.
+    Returns:
+        dict: The product to send to the Printify API.
+    """
+    if image_id is not None and text_colors is not None:
+        raise ValueError("Cannot provide both image_id and text_colors")
+
+    if placement is None:
+        placement = {"x": 0.5, "y": 0.5, "scale": 1}
+
+    print_areas = []
+    if image_id is not None:
+        print_areas = [
+            {
+                "variant_ids": [variant['id'] for variant in variants],
+                "placeholders": [
+                    {
+                        "position": "front",
+                        "images": [
+                            {
+                                "id": image_id,
+                                "x": placement.get("x"),
+                                "y": placement.get("y"),
+                                "scale": placement.get("scale"),
+                                "angle": 0
+                            }
+                        ]
+
+                    }
+                ]
+            }
+        ]
+    else:
+        for color in text_colors:
+            text_image_id = color.get("image_id")
+            print_areas.append(
+                {
+                    "variant_ids": color.get("variant_ids"),
+                    "placeholders": [
+                        {
+                            "position": "front",
+                            "images": [
+                                {
+                                    "id": text_image_id,
+                                    "x": placement.get("x"),
+                                    "y": placement.get("y"),
+                                    "scale": placement.get("scale"),
+                                    "angle": 0
+                                }
+                            ]
+
+                        }
+                    ]
+                }
+            )
+
+    product = {
+        "title": title,
+        "description": description,
+        "blueprint_id": blueprint_id,
+        "print_provider_id": print_provider_id,
+        "tags": marketing_tags,
+        "variants": variants,
+        "print_areas": print_areas
+        # TODO - Not working as expected!!
+        # "sales_channel_properties": {
+        #     "free_shipping": False,
+        #     "collections": ["test"]
+        # }
+    }
+    return product
+
+
+def build_product_repair(product, front_images_only=True, disable_unavailable=True):
+    """
+    Builds the update that trims a product down to its front mockups and
+    available variants. Printify adds every mockup to a new product, so the
+    publish scheduler trims each product right before publishing it.
+    Args:
+        product (dict): The product as fetched from the Printify API.
+        front_images_only (bool): Whether to drop all but the front mockup images.
+        disable_unavailable (bool): Whether to disable enabled variants that are not available.
+    Returns:
+        dict: The fields to update, empty if the product needs no repair.
+    """
+    update = {}
+    if front_images_only:
+        images = product.get("images") or []
+        front_images = [image for image in images if image.get("position") == "front"]
+        if len(front_images) != len(images):
+            update["images"] = front_images
+    if disable_unavailable:
+        variants = product.get("variants") or []
+        if any(variant.get("is_enabled") and not variant.get("is_available") for variant in variants):
+            update["variants"] = [
+                dict(variant, is_enabled=bool(variant.get("is_enabled") and variant.get("is_available")))
+                for variant in variants
+            ]
+    return update
 
 
 class PrintifyUtil():
@@ -32,19 +255,63 @@ class PrintifyUtil():
         self.headers = {
             'Authorization': f'Bearer {self.API_KEY}'
         }
-        self.fetch_store_id()
+        self.session = get_printify_session()
+        self.timeout = (PRINTIFY_CONNECT_TIMEOUT, PRINTIFY_READ_TIMEOUT)
+        self.load_store_id()
         self.typical_size_price = 2399
         self.extended_size_price = 2999
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
+    def request(self, method: str, path: str, budget: str = "general", store_id=None, **kwargs):
+        """
+        Sends a request to the Printify API once the account's rate limit allows it.
+        A 429, or a 5xx to a request that is safe to repeat, is retried after
+        the Retry-After delay or a jittered backoff, and a 429 slows the shared
+        rate for every process.
+        Args:
+            method (str): The HTTP method.
+            path (str): The path below the API root, such as 'shops.json'.
+            budget (str): The rate limit budget the request counts against, "general" or "publish".
+            store_id (int, optional): The shop the request is about, whose budget it counts against as well.
+            **kwargs: Passed on to requests, such as json.
+        Returns:
+            requests.Response: The response.
+        Raises:
+            PrintifyError: If the request is still throttled or failing after PRINTIFY_THROTTLE_RETRIES.
+        """
+        limiter = get_rate_limiter(budget, store_id)
+        for attempt in range(PRINTIFY_THROTTLE_RETRIES + 1):
+            limiter.acquire_blocking()
+            response = self.session.request(
+                method, f"{self.BASE_URL}/{path}", headers=self.headers, timeout=self.timeout, **kwargs)
+            if not should_retry(method, response.status_code):
+                limiter.recover()
+                return response
+            delay = retry_delay(response.headers, attempt)
+            print(f"Printify returned {response.status_code} for {method} {path}, attempt {attempt + 1}.")
+            if response.status_code == 429:
+                # The next acquire waits out the pause
+                limiter.throttle(delay)
+            else:
+                time.sleep(delay)
+        raise PrintifyError(
+            f"{method} {path} failed with status {response.status_code} after {attempt + 1} attempts",
+            response.status_code)
+
+    def load_store_id(self):
+        """Sets self.store_id from the cache, fetching it from the Printify API only when it is not cached."""
+        shops = printify_cache.get("shops.json")
+        if shops:
+            self.store_id = shops[0]['id']
+            return self.store_id
+        return self.fetch_store_id()
+
     def fetch_store_id(self):
         """Fetches the store ID from the Printify API and stores it in self.store_id."""
-        url = f"{self.BASE_URL}/shops.json"
-        response = requests.get(url, headers=self.headers)
+        response = self.request("GET", "shops.json")
         if response.status_code == 200:
             data = response.json()
             if data:
+                printify_cache.set("shops.json", data)
                 # Collect the first available store ID
                 self.store_id = data[0]['id']
                 print(f"Store ID: {self.store_id}")
@@ -55,108 +322,76 @@ class PrintifyUtil():
             print(f"Failed to fetch stores. Status code: {
                   response.status_code}")
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
     def get_product_catalog(self):
         """Fetches and prints the product catalog from the Printify API."""
-        url = f"{self.BASE_URL}/catalog/products.json"
-        response = requests.get(url, headers=self.headers)
+        response = self.request("GET", "catalog/products.json")
         if response.status_code == 200:
             print("Successfully fetched product catalog")
         else:
             print(f"Failed to fetch product catalog. Status code: {
                   response.status_code}")
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
+    def get_catalog(self, path):
+        """Returns catalog data from the cache, fetching it from the Printify API when it is missing or expired."""
+        data = printify_cache.get(path)
+        if data is None:
+            data = self.fetch_catalog(path)
+            if data is not None:
+                printify_cache.set(path, data)
+        return data
+
+    def fetch_catalog(self, path):
+        """Fetches catalog data, such as 'catalog/blueprints/6/print_providers.json', from the Printify API."""
+        response = self.request("GET", path)
+        if response.status_code != 200:
+            print(f"Failed to fetch {path}. Status code: {response.status_code}")
+            return None
+        print(f"Successfully fetched {path}")
+        return response.json()
+
     def get_all_providers(self, blueprint_id):
         """Given a blueprint_id, get all print providers for that blueprint."""
-        uri = f"{
-            self.BASE_URL}/catalog/blueprints/{blueprint_id}/print_providers.json"
-        response = requests.get(uri, headers=self.headers)
-        if response.status_code != 200:
-            print(f"Failed to fetch print providers. Status code: {
-                  response.status_code}")
-        print("Successfully fetched print providers")
+        providers = self.get_catalog(
+            f"catalog/blueprints/{blueprint_id}/print_providers.json")
         provider_ids = []
-        for provider in response.json():
+        for provider in providers:
             provider_ids.append(provider['id'])
         return provider_ids
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
+    def get_variant_index(self, blueprint_id, print_provider_id):
+        """
+        Returns the supported variants of a print provider by (color, size),
+        each with its "id", "price" and whether it "is_enabled". The index is
+        built once per catalog download.
+        """
+        # The catalog leaves out variants that are out of stock, so every
+        # variant listed here can be enabled when the product is created
+        path = f"catalog/blueprints/{blueprint_id}/print_providers/{print_provider_id}/variants.json"
+        catalog = self.get_catalog(path)
+        cached = _variant_indexes.get(path)
+        if cached is None or cached[0] is not catalog:
+            cached = (catalog, build_variant_index(
+                catalog, self.typical_size_price, self.extended_size_price))
+            _variant_indexes[path] = cached
+        return cached[1]
+
     def get_all_variants(self, blueprint_id, print_provider_id):
         """Given a product ID and print provider id get all unique variants per print provider"""
-        url = f"{self.BASE_URL}/catalog/blueprints/{
-            blueprint_id}/print_providers/{print_provider_id}/variants.json"
-        response = requests.get(url, headers=self.headers)
-        if response.status_code != 200:
-            print(f"Failed to fetch product catalog. Status code: {
-                  response.status_code}")
-        print("Successfully fetched variants")
         return_response = []
         default_variant_set = False
         light_variant_ids = []
         dark_variant_ids = []
-        supported_colors = [
-            "Black",
-            "White",
-            "Cardinal Red",
-            "Carolina Blue",
-            "Sport Grey",
-            "Red",
-            "Light Pink",
-            "Navy",
-            "Sapphire",
-            "Sunset",
-            "Turf Green",
-            "Military Green",
-            "Heliconia",
-            "Charcoal",
-            "Purple",
-            "Heather Sapphire"
-        ]
         # Set a default color for the product
-        default_color = random.choice(supported_colors)
+        default_color = random.choice(SUPPORTED_COLORS)
 
-        for variant in response.json()['variants']:
-            price = None
+        for (color, size), variant in self.get_variant_index(blueprint_id, print_provider_id).items():
             default_variant = False
-            available = True
-            variant_count = 0
-
-            # Don't allow colors that are outside of the supported colors
-            if variant['options'].get('color') not in supported_colors:
-                continue
-
-            # Don't allow certain sizes outside of the supported sizes
-            match variant['options']['size']:
-                case "XS":
-                    price = self.typical_size_price
-                case "S":
-                    price = self.typical_size_price
-                case "M":
-                    price = self.typical_size_price
-                case "L":
-                    price = self.typical_size_price
-                    if variant['options']['color'] == default_color and not default_variant_set:
-                        default_variant = True
-                        default_variant_set = True
-                case "XL":
-                    price = self.typical_size_price
-                case "2XL":
-                    price = self.typical_size_price
-                case _:
-                    price = self.extended_size_price
-                    available = False
-
-            # Remove variants if more than 100
-            if variant_count > 100:
-                print("TOO MANY VARIANTS, MAXIMUM 100. SKIPPING REMAINING VARIANTS")
-                continue
+            if size == "L" and color == default_color and not default_variant_set:
+                default_variant = True
+                default_variant_set = True
 
             # Split variants into light and dark colors
-            if variant['options']['color'] in ["White", "Sport Grey"]:
+            if color in LIGHT_COLORS:
                 light_variant_ids.append(variant['id'])
             else:
                 dark_variant_ids.append(variant['id'])
@@ -164,41 +399,31 @@ class PrintifyUtil():
             # Append variant to return response
             return_response.append({
                 'id': variant['id'],
-                "price": price,
-                "is_enabled": available,
+                "price": variant['price'],
+                "is_enabled": variant['is_enabled'],
                 "is_default": default_variant
             })
-            variant_count += 1
         return return_response, light_variant_ids, dark_variant_ids
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
     def get_shipping_costs(self, blueprint_id, print_provider_id):
         """Given a product ID, print provider id, and variants, get USA shipping costs for each variant"""
-        url = f"{self.BASE_URL}/catalog/blueprints/{
-            blueprint_id}/print_providers/{print_provider_id}/shipping.json"
-        response = requests.get(url, headers=self.headers)
-        if response.status_code != 200:
-            print(f"Failed to fetch shipping costs. Status code: {
-                  response.status_code}")
+        shipping = self.get_catalog(
+            f"catalog/blueprints/{blueprint_id}/print_providers/{print_provider_id}/shipping.json")
 
-        for shipping_cost in response.json().get("profiles"):
+        for shipping_cost in shipping.get("profiles"):
             if "US" in shipping_cost.get("countries"):
                 cost = shipping_cost.get("first_item").get("cost")
                 return cost
         return None
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
     def upload_image(self, image_url: str):
         """Uploads an image to Printify and returns the URL."""
-        url = f"{self.BASE_URL}/uploads/images.json"
         file_name = image_url.split("/")[-1]
         data = {
             "file_name": file_name,
             "url": image_url
         }
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self.request("POST", "uploads/images.json", json=data)
         if response.status_code == 200:
             print(f"Image uploaded successfully: {file_name}")
             print("Image ID: ", response.json()['id'])
@@ -209,8 +434,20 @@ class PrintifyUtil():
             print(response.json())
             return None
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
+    def upload_image_contents(self, file_name: str, data: bytes):
+        """Uploads the bytes of an image to Printify, without hosting it anywhere first, and returns its ID."""
+        data = {
+            "file_name": file_name,
+            "contents": base64.b64encode(data).decode("ascii")
+        }
+        response = self.request("POST", "uploads/images.json", json=data)
+        if response.status_code == 200:
+            print(f"Image uploaded successfully: {file_name}")
+            return response.json()['id']
+        print(f"Failed to upload image. Status code: {response.status_code}")
+        print(response.text)
+        return None
+
     def create_product(
             self,
             blueprint_id,
@@ -221,13 +458,12 @@ class PrintifyUtil():
             marketing_tags,
             text_colors=None,
             image_id=None,
+            placement=None,
     ):
         """
         Creates a new product on Printify.
 
-        This function is decorated with:
-        - @sleep_and_retry: Ensures that the function will retry after sleeping if a rate limit is hit.
-        - @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD): Enforces the rate limit for the number of calls to the Printify API within a specified period.
+        The request waits for the account's shared general rate limit, see request.
 
         Args:
             blueprint_id (int): The ID of the blueprint for the product.
@@ -238,76 +474,26 @@ class PrintifyUtil():
             marketing_tags (list): A list of marketing tags for the product.
             text_colors (list, optional): A list of text colors for the product. Defaults to None.
             image_id (str, optional): The ID of the image for the product. Defaults to None.
+            placement (dict, optional): The "x", "y" and "scale" of the images on the
+                print area, as returned for cropped print files. Defaults to a
+                full width image in the center.
 
         Returns:
             product_id (str): The ID of the created product. or None if the product creation failed.
         """
-        url = f"{self.BASE_URL}/shops/{self.store_id}/products.json"
-
-        if image_id is not None and text_colors is not None:
-            raise ValueError("Cannot provide both image_id and text_colors")
-
-        print_areas = []
-        if image_id is not None:
-            print_areas = [
-                {
-                    "variant_ids": [variant['id'] for variant in variants],
-                    "placeholders": [
-                        {
-                            "position": "front",
-                            "images": [
-                                {
-                                    "id": image_id,
-                                    "x": 0.5,
-                                    "y": 0.5,
-                                    "scale": 1,
-                                    "angle": 0
-                                }
-                            ]
-
-                        }
-                    ]
-                }
-            ]
-        else:
-            for color in text_colors:
-                text_image_id = color.get("image_id")
-                print_areas.append(
-                    {
-                        "variant_ids": color.get("variant_ids"),
-                        "placeholders": [
-                            {
-                                "position": "front",
-                                "images": [
-                                    {
-                                        "id": text_image_id,
-                                        "x": 0.5,
-                                        "y": 0.5,
-                                        "scale": 1,
-                                        "angle": 0
-                                    }
-                                ]
-
-                            }
-                        ]
-                    }
-                )
-
-        product = {
-            "title": title,
-            "description": description,
-            "blueprint_id": blueprint_id,
-            "print_provider_id": print_provider_id,
-            "tags": marketing_tags,
-            "variants": variants,
-            "print_areas": print_areas
-            # TODO - Not working as expected!!
-            # "sales_channel_properties": {
-            #     "free_shipping": False,
-            #     "collections": ["test"]
-            # }
-        }
-        response = requests.post(url, headers=self.headers, json=product)
+        product = build_product(
+            blueprint_id,
+            print_provider_id,
+            variants,
+            title,
+            description,
+            marketing_tags,
+            text_colors=text_colors,
+            image_id=image_id,
+            placement=placement
+        )
+        response = self.request(
+            "POST", f"shops/{self.store_id}/products.json", store_id=self.store_id, json=product)
         if response.status_code == 200:
             print(f"Product created successfully: {response.json()['id']}")
             return response.json()['id']
@@ -316,43 +502,35 @@ class PrintifyUtil():
                   response.status_code}")
             return None
 
-    @sleep_and_retry
-    @limits(calls=PUBLISH_RATE_LIMIT, period=PUBLISH_RATE_PERIOD)
     def publish_product(self, product_id):
         """Publishes a product in Printify."""
-        url = f"{
-            self.BASE_URL}/shops/{self.store_id}/products/{product_id}/publish.json"
-        data = {
-            "title": True,
-            "description": True,
-            "images": True,
-            "variants": True,
-            "tags": True
-        }
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self.request(
+            "POST",
+            f"shops/{self.store_id}/products/{product_id}/publish.json",
+            budget="publish",
+            store_id=self.store_id,
+            json=PUBLISH_PROPERTIES
+        )
         if response.status_code == 200:
             print(f"Product published: {product_id}")
         else:
             print(f"Failed to publish product. Status code: {
                   response.status_code}")
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
     def get_product_by_id(self, product_id):
         """Fetches a product by ID from the Printify API."""
-        url = f"{self.BASE_URL}/shops/{self.store_id}/products/{product_id}.json"
-        response = requests.get(url, headers=self.headers)
+        response = self.request(
+            "GET", f"shops/{self.store_id}/products/{product_id}.json", store_id=self.store_id)
         if response.status_code == 200:
             print(f"Successfully fetched product: {product_id}")
             return response.json()
         print(f"Failed to fetch product. Status code: {response.status_code}")
+        return None
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
     def update_product_by_id(self, product_id, product):
         """Updates a product by ID in Printify."""
-        url = f"{self.BASE_URL}/shops/{self.store_id}/products/{product_id}.json"
-        response = requests.put(url, headers=self.headers, json=product)
+        response = self.request(
+            "PUT", f"shops/{self.store_id}/products/{product_id}.json", store_id=self.store_id, json=product)
         if response.status_code == 200:
             print(f"Product updated successfully: {product_id}")
         else:
@@ -360,32 +538,34 @@ class PrintifyUtil():
                   response.status_code}")
             print(response.json())
 
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
+    def repair_product(self, product_id, front_images_only=True, disable_unavailable=True):
+        """
+        Trims a product down to its front mockups and available variants,
+        with one fetch and at most one update. See build_product_repair.
+        Returns:
+            dict: The update sent, empty if the product needed none, or None if it could not be fetched.
+        """
+        product = self.get_product_by_id(product_id)
+        if product is None:
+            return None
+        update = build_product_repair(product, front_images_only, disable_unavailable)
+        if update:
+            self.update_product_by_id(product_id, update)
+        return update
+
     def remove_unavailable_variants(self, product_id):
         """Removes unavailable variants from a product."""
         product = self.get_product_by_id(product_id)
-        variants = product['variants']
-        for variant in variants:
-            available = variant.get("is_available")
-            enabled = variant.get("is_enabled")
-            if not available and enabled:
-                enabled = False
-            variant["is_enabled"] = enabled
-        self.update_product_by_id(product_id, {"variants": variants})
-        return variants
-
-    @sleep_and_retry
-    @limits(calls=PRINTIFY_RATE_LIMIT, period=PRINTIFY_RATE_PERIOD)
+        if product is None:
+            return None
+        update = build_product_repair(product, front_images_only=False)
+        if update:
+            self.update_product_by_id(product_id, update)
+        return update.get("variants", product['variants'])
+
     def only_front_product_images_by_product_id(self, product_id):
         """Removes all but the front images from a product."""
-        product = self.get_product_by_id(product_id)
-
-        images = product.get("images")
-        for image in images:
-            if image.get("position") != "front":
-                images.remove(image)
-        self.update_product_by_id(product_id, {"images": images})
+        return self.repair_product(product_id, disable_unavailable=False)
 
 
 if __name__ == "__main__":
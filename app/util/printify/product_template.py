@@ -0,0 +1,89 @@
+"""This is a utility class for encoding create product requests from a pre-encoded template."""
+import json
+import threading
+
+# Templates kept, one per blueprint, provider, variant set and color split
+PRODUCT_TEMPLATE_CACHE_SIZE = 32
+
+
+class ProductTemplate:
+    """
+    The create product request of a blueprint and print provider, with the
+    variants and the variant IDs of each print area encoded to JSON once.
+    Encoding a product only adds its title, description, tags and images,
+    and produces the same request as build_product.
+    """
+
+    def __init__(self, blueprint_id, print_provider_id, variants, text_colors):
+        """
+        Args:
+            blueprint_id (int): The ID of the blueprint for the products.
+            print_provider_id (int): The ID of the print provider.
+            variants (list): The variants of the products, as returned by get_all_variants.
+            text_colors (list): The print areas, one per color with its "variant_ids".
+        """
+        self.head = (
+            f'{{"blueprint_id":{json.dumps(blueprint_id)},'
+            f'"print_provider_id":{json.dumps(print_provider_id)},'
+            f'"variants":{json.dumps(variants, separators=(",", ":"))},'
+        )
+        self.area_heads = [
+            f'{{"variant_ids":{json.dumps(color.get("variant_ids"), separators=(",", ":"))},'
+            '"placeholders":[{"position":"front","images":['
+            for color in text_colors
+        ]
+
+    def encode(self, title, description, marketing_tags, image_ids, placement=None):
+        """
+        Encodes the create product request of one product.
+        Args:
+            title (str): The title of the product.
+            description (str): The description of the product.
+            marketing_tags (list): A list of marketing tags for the product.
+            image_ids (list): The ID of the image of each print area, in the order of text_colors.
+            placement (dict, optional): The "x", "y" and "scale" of the images,
+                a full width image in the center by default.
+        Returns:
+            bytes: The JSON body of the request.
+        """
+        if placement is None:
+            placement = {"x": 0.5, "y": 0.5, "scale": 1}
+        position = (
+            f'"x":{json.dumps(placement.get("x"))},'
+            f'"y":{json.dumps(placement.get("y"))},'
+            f'"scale":{json.dumps(placement.get("scale"))},"angle":0}}]}}]}}'
+        )
+        print_areas = ",".join(
+            f'{area_head}{{"id":{json.dumps(image_id)},{position}'
+            for area_head, image_id in zip(self.area_heads, image_ids)
+        )
+        body = (
+            f'{self.head}"title":{json.dumps(title)},'
+            f'"description":{json.dumps(description)},'
+            f'"tags":{json.dumps(marketing_tags)},'
+            f'"print_areas":[{print_areas}]}}'
+        )
+        return body.encode("utf-8")
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_product_template(blueprint_id, print_provider_id, variants, text_colors):
+    """Returns the template of a blueprint, provider, variant set and color split, encoding it on first use."""
+    key = (
+        blueprint_id,
+        print_provider_id,
+        tuple((variant['id'], variant['price'], variant['is_enabled'], variant['is_default']) for variant in variants),
+        tuple(tuple(color.get("variant_ids")) for color in text_colors)
+    )
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None:
+            if len(_templates) >= PRODUCT_TEMPLATE_CACHE_SIZE:
+                # Drop the oldest template
+                del _templates[next(iter(_templates))]
+            template = ProductTemplate(blueprint_id, print_provider_id, variants, text_colors)
+            _templates[key] = template
+        return template
@@ -0,0 +1,485 @@
+"""This is a utility module for sharing the Printify rate limits between callers."""
+from email.utils import parsedate_to_datetime
+from os import getenv
+import asyncio
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from firebase_admin import firestore
+
+# Prinitify Rate Limits
+PRINTIFY_RATE_LIMIT = 600
+PRINTIFY_RATE_PERIOD = 60  # 1 minute
+PUBLISH_RATE_LIMIT = 200
+PUBLISH_RATE_PERIOD = 1800  # 30 minutes
+
+# Where the budget is kept: "memory" for this process only, "sqlite" for the
+# processes of one host, "firestore" for every replica
+PRINTIFY_RATE_LIMIT_BACKEND = getenv("PRINTIFY_RATE_LIMIT_BACKEND", "sqlite")
+PRINTIFY_RATE_LIMIT_FILE = getenv("PRINTIFY_RATE_LIMIT_FILE", "./printify_rate_limit.db")
+PRINTIFY_RATE_LIMIT_COLLECTION = "RateLimits"
+# Tokens the firestore backend takes from the shared document per transaction,
+# so the document is written about once per this many requests
+PRINTIFY_RATE_LIMIT_BATCH = int(getenv("PRINTIFY_RATE_LIMIT_BATCH", "10"))
+
+# Retries of a request that was throttled (429) or failed with a 5xx response
+PRINTIFY_THROTTLE_RETRIES = int(getenv("PRINTIFY_THROTTLE_RETRIES", "5"))
+# Backoff when Printify does not say how long to wait, doubled on every attempt
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# A 429 multiplies the rate by THROTTLE_DECREASE, down to MIN_THROTTLE_FACTOR
+# of the limit, and every healthy response adds RECOVERY_STEP back
+THROTTLE_DECREASE = 0.5
+MIN_THROTTLE_FACTOR = 0.1
+RECOVERY_STEP = 0.02
+
+# The limit and period of each budget of a Printify account
+RATE_LIMITS = {
+    "general": (PRINTIFY_RATE_LIMIT, PRINTIFY_RATE_PERIOD),
+    "publish": (PUBLISH_RATE_LIMIT, PUBLISH_RATE_PERIOD)
+}
+
+# Requests that are safe to send again after a 5xx response
+IDEMPOTENT_METHODS = {"GET", "PUT", "HEAD", "OPTIONS", "DELETE"}
+
+
+class TokenBucket:
+    """
+    A token bucket that never lets more than limit calls through in any
+    window of period seconds. Up to burst calls can go at once, the rest
+    are spread evenly at (limit - burst) / period calls per second.
+
+    When Printify throttles a request anyway, the bucket pauses every caller
+    for the Retry-After delay and halves its rate, then ramps back up to the
+    full rate as responses come back healthy.
+
+    This bucket keeps its state in memory, it is thread-safe and can be
+    awaited from any event loop. Subclasses keep the same state elsewhere
+    by overriding update.
+    """
+    # Whether updating the state does I/O that should stay off the event loop
+    blocking = False
+
+    def __init__(self, limit: int, period: float, burst: int = None):
+        self.limit = limit
+        self.period = period
+        self.burst = burst if burst is not None else max(1, limit // 10)
+        self.rate = (limit - self.burst) / period
+        # The rate multiplier seen last, to skip recovering a bucket at full rate
+        self.factor = 1.0
+        self.state = None
+        self.lock = threading.Lock()
+
+    def update(self, change):
+        """
+        Applies a change to the state of the bucket atomically.
+        Args:
+            change (callable): Called with the state, None for a new bucket,
+                and the current time. Returns the new state and a result.
+        Returns:
+            The result of the change.
+        """
+        with self.lock:
+            self.state, result = change(self.state, time.monotonic())
+            self.factor = self.state["factor"]
+            return result
+
+    def refill(self, state, now):
+        """Returns a copy of the state with the tokens refilled up to now."""
+        if not state:
+            return {"tokens": float(self.burst), "updated": now, "factor": 1.0, "paused_until": 0.0}
+        state = dict(state)
+        elapsed = max(0.0, now - state["updated"])
+        state["tokens"] = min(self.burst, state["tokens"] + elapsed * self.rate * state["factor"])
+        state["updated"] = now
+        return state
+
+    def take(self, state, now):
+        """Takes a token from the state, returns the new state and the seconds to wait, 0 if a token was taken."""
+        state = self.refill(state, now)
+        if now < state["paused_until"]:
+            return state, state["paused_until"] - now
+        if state["tokens"] >= 1:
+            state["tokens"] -= 1
+            return state, 0.0
+        return state, (1 - state["tokens"]) / (self.rate * state["factor"])
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available.
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds to wait
+                before one is available.
+        """
+        return self.update(self.take)
+
+    def throttle(self, delay: float):
+        """Pauses the bucket for delay seconds after a 429 and slows its rate."""
+        def change(state, now):
+            state = self.refill(state, now)
+            # Requests in flight get throttled together, slow down once per pause
+            if now >= state["paused_until"]:
+                state["factor"] = max(MIN_THROTTLE_FACTOR, state["factor"] * THROTTLE_DECREASE)
+            state["paused_until"] = max(state["paused_until"], now + delay)
+            # No burst when the pause ends
+            state["tokens"] = 0.0
+            return state, state["factor"]
+
+        factor = self.update(change)
+        print(f"Printify rate limit hit, pausing {delay:.1f}s at {factor:.0%} of the rate.")
+
+    def recover(self):
+        """Speeds a throttled bucket back up after a healthy response."""
+        if self.factor >= 1:
+            return
+
+        def change(state, now):
+            state = self.refill(state, now)
+            state["factor"] = min(1.0, state["factor"] + RECOVERY_STEP)
+            return state, None
+
+        self.update(change)
+
+    def available(self):
+        """Returns the tokens available now, 0 while the bucket is paused."""
+        def change(state, now):
+            state = self.refill(state, now)
+            return state, 0.0 if now < state["paused_until"] else state["tokens"]
+
+        return self.update(change)
+
+    def acquire_blocking(self):
+        """Waits on the calling thread until a token is taken, returns the seconds waited."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire(self):
+        """Waits without blocking the event loop until a token is taken, returns the seconds waited."""
+        waited = 0.0
+        while True:
+            if self.blocking:
+                wait = await asyncio.to_thread(self.try_acquire)
+            else:
+                wait = self.try_acquire()
+            if wait == 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+class SqliteTokenBucket(TokenBucket):
+    """
+    A token bucket kept in a SQLite file, shared by every process on the
+    host that opens the same file, such as the uvicorn workers. Each update
+    runs in an immediate transaction, which locks the file for writing.
+    """
+    blocking = True
+
+    def __init__(self, name: str, limit: int, period: float, path: str, burst: int = None):
+        super().__init__(limit, period, burst)
+        self.name = name
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        """Returns the connection of the calling thread, opening it on first use."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bucket_states (name TEXT PRIMARY KEY, state TEXT)")
+            self.local.connection = connection
+        return connection
+
+    def update(self, change):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT state FROM bucket_states WHERE name = ?", (self.name,)).fetchone()
+            # Wall clock time, since the state is shared between processes
+            state, result = change(json.loads(row[0]) if row else None, time.time())
+            connection.execute(
+                "INSERT OR REPLACE INTO bucket_states (name, state) VALUES (?, ?)",
+                (self.name, json.dumps(state)))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self.factor = state["factor"]
+        return result
+
+
+class FirestoreTokenBucket(TokenBucket):
+    """
+    A token bucket kept in a Firestore document, shared by every replica
+    of the app. Each update is a Firestore transaction, so concurrent
+    updates are retried rather than lost.
+
+    A document takes about one sustained write per second, so tokens are
+    taken from it in batches of up to PRINTIFY_RATE_LIMIT_BATCH and handed
+    out from this process, and healthy responses are added to the rate with
+    the next batch rather than one write each.
+    """
+    blocking = True
+
+    def __init__(self, name: str, limit: int, period: float, db=None, burst: int = None,
+                 batch: int = PRINTIFY_RATE_LIMIT_BATCH):
+        super().__init__(limit, period, burst)
+        self.name = name
+        self.db = db
+        self.batch = max(1, min(batch, self.burst))
+        # Tokens taken from the document and not handed out yet
+        self.reserve = 0
+        # Healthy responses not added to the document's rate yet
+        self.recovered = 0
+        # When the document is worth asking again after it had no tokens
+        self.retry_at = 0.0
+        self.local_lock = threading.Lock()
+
+    def document(self):
+        """Returns the document of the bucket."""
+        if self.db is None:
+            # The default Firebase app is initialized at startup
+            self.db = firestore.client()
+        return self.db.collection(PRINTIFY_RATE_LIMIT_COLLECTION).document(self.name)
+
+    def update(self, change):
+        """See TokenBucket.update, a change that returns None for the state leaves the document as is."""
+        document = self.document()
+
+        @firestore.transactional
+        def update_in_transaction(transaction):
+            snapshot = document.get(transaction=transaction)
+            state = snapshot.to_dict() if snapshot.exists else None
+            new_state, result = change(state, time.time())
+            if new_state is None:
+                return state, result
+            transaction.set(document, new_state)
+            return new_state, result
+
+        state, result = update_in_transaction(self.db.transaction())
+        self.factor = state["factor"]
+        return result
+
+    def try_acquire(self):
+        # One transaction at a time, the other threads of the process wait for its batch
+        with self.local_lock:
+            if self.reserve > 0:
+                self.reserve -= 1
+                return 0.0
+            now = time.time()
+            if now < self.retry_at:
+                return self.retry_at - now
+            recovered, self.recovered = self.recovered, 0
+
+            def take_batch(state, now):
+                refilled = self.refill(state, now)
+                if recovered:
+                    refilled["factor"] = min(1.0, refilled["factor"] + RECOVERY_STEP * recovered)
+                if now < refilled["paused_until"]:
+                    wait = refilled["paused_until"] - now
+                else:
+                    count = min(self.batch, int(refilled["tokens"]))
+                    if count >= 1:
+                        refilled["tokens"] -= count
+                        return refilled, (count, 0.0)
+                    # Come back for a whole batch, not a token per transaction
+                    wait = (self.batch - refilled["tokens"]) / (self.rate * refilled["factor"])
+                # Nothing taken, only write the rate if it recovered
+                return (refilled if recovered else None), (0, wait)
+
+            count, wait = self.update(take_batch)
+            if count == 0:
+                self.retry_at = time.time() + wait
+                return wait
+            self.reserve += count - 1
+            return 0.0
+
+    def throttle(self, delay: float):
+        # The tokens in reserve would go out during the pause
+        with self.local_lock:
+            self.reserve = 0
+        super().throttle(delay)
+
+    def recover(self):
+        if self.factor >= 1:
+            return
+        with self.local_lock:
+            self.recovered += 1
+
+    def available(self):
+        # A plain read, the router asks for every product it places
+        snapshot = self.document().get()
+        now = time.time()
+        state = self.refill(snapshot.to_dict() if snapshot.exists else None, now)
+        with self.local_lock:
+            reserve = self.reserve
+        return reserve + (0.0 if now < state["paused_until"] else state["tokens"])
+
+
+def should_retry(method: str, status_code: int):
+    """Returns whether a response is worth retrying: a 429, or a 5xx to a request that is safe to repeat."""
+    if status_code == 429:
+        return True
+    return status_code in (500, 502, 503, 504) and method.upper() in IDEMPOTENT_METHODS
+
+
+def retry_delay(headers, attempt: int):
+    """
+    Returns the seconds to wait before retrying a response.
+    Args:
+        headers: The response headers, Retry-After is used when present.
+        attempt (int): The number of retries so far, for the exponential backoff.
+    """
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            # Jitter, so the callers paused together do not return together
+            return max(0.0, delay) + random.uniform(0, BACKOFF_BASE)
+    # Full jitter exponential backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def account_key():
+    """Returns an ID of the Printify account, so every process with the same API key shares a budget."""
+    api_key = getenv("PRINTIFY_API_KEY") or ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class ShopRateLimiter:
+    """
+    The rate limit of requests about a shop's products, which count against
+    both the budget of the shop and the budget of its account. Every request
+    takes a token from each bucket, the shop's first, so a request waiting on
+    its shop does not hold up the other shops of the account.
+    """
+
+    def __init__(self, account: TokenBucket, shop: TokenBucket):
+        self.account = account
+        self.shop = shop
+        self.blocking = account.blocking or shop.blocking
+
+    def throttle(self, delay: float):
+        """Pauses both buckets, a 429 does not say which of the limits was hit."""
+        self.shop.throttle(delay)
+        self.account.throttle(delay)
+
+    def recover(self):
+        """Speeds both buckets back up after a healthy response."""
+        self.shop.recover()
+        self.account.recover()
+
+    def available(self):
+        """Returns the tokens available now for a request about the shop."""
+        return min(self.shop.available(), self.account.available())
+
+    def acquire_blocking(self):
+        """Waits on the calling thread until a token of both buckets is taken, returns the seconds waited."""
+        return self.shop.acquire_blocking() + self.account.acquire_blocking()
+
+    async def acquire(self):
+        """Waits without blocking the event loop until a token of both buckets is taken, returns the seconds waited."""
+        return await self.shop.acquire() + await self.account.acquire()
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(budget: str, store_id=None):
+    """
+    Returns the bucket of a budget of the account, or of one of its shops,
+    creating it with PRINTIFY_RATE_LIMIT_BACKEND on first use.
+    """
+    key = (budget, store_id)
+    with _buckets_lock:
+        if key not in _buckets:
+            limit, period = RATE_LIMITS[budget]
+            if store_id is None:
+                name = f"printify-{account_key()}-{budget}"
+            else:
+                name = f"printify-{account_key()}-shop-{store_id}-{budget}"
+            if PRINTIFY_RATE_LIMIT_BACKEND == "firestore":
+                bucket = FirestoreTokenBucket(name, limit, period)
+            elif PRINTIFY_RATE_LIMIT_BACKEND == "sqlite":
+                bucket = SqliteTokenBucket(name, limit, period, PRINTIFY_RATE_LIMIT_FILE)
+            else:
+                bucket = TokenBucket(limit, period)
+            _buckets[key] = bucket
+        return _buckets[key]
+
+
+def get_rate_limiter(budget: str = "general", store_id=None):
+    """
+    Returns the rate limiter of a request. Requests about a shop's products
+    count against the budget of the shop and of the account, the others,
+    such as uploads and the catalog, against the account's only.
+    Args:
+        budget (str): "general" for all requests but publishing, or "publish".
+        store_id (int, optional): The shop the request is about.
+    Returns:
+        TokenBucket or ShopRateLimiter: The limiter, with acquire, throttle and recover.
+    """
+    if store_id is None:
+        return get_bucket(budget)
+    return ShopRateLimiter(get_bucket(budget), get_bucket(budget, store_id))
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    # A small budget: 20 calls per 2 seconds, 2 of them at once, the rest 9 per second
+    example_path = os.path.join(tempfile.mkdtemp(), "rate_limit.db")
+    for bucket in (TokenBucket(20, 2), SqliteTokenBucket("example", 20, 2, example_path)):
+        start = time.monotonic()
+        for _ in range(20):
+            bucket.acquire_blocking()
+        print(f"{type(bucket).__name__}: 20 calls took {time.monotonic() - start:.2f}s, expected about 2s")
+
+        # A 429 pauses every caller, then the bucket goes on at half the rate
+        bucket.throttle(0.5)
+        start = time.monotonic()
+        bucket.acquire_blocking()
+        print(f"First call after the 429 waited {time.monotonic() - start:.2f}s at {bucket.factor:.0%} of the rate")
+
+    # Two shops share the budget of their account
+    account = TokenBucket(20, 2)
+    shops = [ShopRateLimiter(account, TokenBucket(20, 2)) for _ in range(2)]
+
+    async def count_calls(seconds: float):
+        """Counts the calls both shops get through in the given time."""
+        calls = 0
+        end = time.monotonic() + seconds
+
+        async def call(limiter):
+            nonlocal calls
+            while time.monotonic() < end:
+                await limiter.acquire()
+                calls += 1
+
+        await asyncio.gather(*(call(limiter) for limiter in shops))
+        return calls
+
+    calls = asyncio.run(count_calls(2))
+    print(f"Two shops made {calls} calls in 2s, the account allows about 20")
+
+    print(f"Retry a 503 to a POST: {should_retry('POST', 503)}, to a GET: {should_retry('GET', 503)}")
+    print(f"Delay for Retry-After 3: {retry_delay({'Retry-After': '3'}, 0):.1f}s")
@@ -0,0 +1,65 @@
+"""This is a utility class for spreading new products across the Printify shops."""
+from os import getenv
+import threading
+
+from util.printify.rate_limit import get_bucket
+
+# Comma separated IDs of the shops products are created in, the account's first shop when empty
+PRINTIFY_SHOPS = [int(shop_id) for shop_id in getenv("PRINTIFY_SHOPS", "").split(",") if shop_id.strip()]
+
+
+class ShopRouter:
+    """
+    Picks the shop for each new product. Every shop has its own rate
+    budgets, so spreading products across shops raises the creation and
+    publish throughput, up to the budgets of the account they share. The
+    least loaded shop is the one with the most tokens left in its own
+    budget, less the products this process has sent
+    its way that are not created yet.
+    """
+
+    def __init__(self, shop_ids: list):
+        self.shop_ids = list(shop_ids)
+        self.pending = {shop_id: 0 for shop_id in self.shop_ids}
+        self.lock = threading.Lock()
+
+    def load(self, shop_id: int):
+        """Returns how busy a shop is, lower is less busy."""
+        return self.pending[shop_id] - get_bucket("general", shop_id).available()
+
+    def pick(self):
+        """Returns the least loaded shop and counts a product as pending in it, see release."""
+        with self.lock:
+            if len(self.shop_ids) == 1:
+                shop_id = self.shop_ids[0]
+            else:
+                shop_id = min(self.shop_ids, key=self.load)
+            self.pending[shop_id] += 1
+            return shop_id
+
+    def release(self, shop_id: int):
+        """Stops counting a product picked for a shop as pending, once it is created or failed."""
+        with self.lock:
+            self.pending[shop_id] -= 1
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_shop_router(default_store_id: int):
+    """
+    Returns the router of PRINTIFY_SHOPS, or of default_store_id alone when
+    no shops are configured.
+    Raises:
+        ValueError: If no shops are configured and default_store_id is None.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            shop_ids = PRINTIFY_SHOPS or [default_store_id]
+            # Never cache a router that would send every product to shops/None
+            if None in shop_ids:
+                raise ValueError("No Printify shop to create products in, set PRINTIFY_SHOPS or check the store ID")
+            _router = ShopRouter(shop_ids)
+        return _router
@@ -0,0 +1,149 @@
+"""This is a utility module that stores rendered images on disk by the hash of their inputs."""
+import os
+import json
+import uuid
+import hashlib
+import threading
+
+# Bump when a change to the rendering code changes the output images
+RENDER_CACHE_VERSION = 1
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "./render_cache")
+# Maximum size of the cache, 0 disables it
+RENDER_CACHE_MAX_MB = int(os.getenv("RENDER_CACHE_MAX_MB", "512"))
+# An eviction pass frees the cache down to this fraction of its maximum size,
+# so the next entries fit without another pass
+RENDER_CACHE_EVICT_TO = 0.9
+
+
+class RenderCache:
+    """
+    A content-addressed store of rendered PNG files. Each entry is the image
+    and a JSON file of its metadata, named by the hash of everything that
+    went into rendering it. Entries are written atomically, so the cache can
+    be shared by the render processes. Once the cache grows past max_bytes
+    the least recently used entries are removed, down to
+    RENDER_CACHE_EVICT_TO of max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Estimated size on disk, recounted by every eviction pass
+        self.size_estimate = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(**inputs):
+        """Returns the hash of the render inputs, such as text, font, dimensions and color."""
+        inputs["version"] = RENDER_CACHE_VERSION
+        encoded = json.dumps(inputs, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def paths(self, key: str):
+        """Returns the image and metadata paths of an entry."""
+        base = os.path.join(self.directory, key[:2], key)
+        return f"{base}.png", f"{base}.json"
+
+    def get(self, key: str):
+        """
+        Looks up an entry and marks it as recently used.
+        Returns:
+            dict: The metadata of the entry with the "path" of its image, or
+                None if it is not cached.
+        """
+        image_path, meta_path = self.paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                metadata = json.load(meta_file)
+            os.utime(image_path)
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        metadata["path"] = image_path
+        return metadata
+
+    def put(self, key: str, data: bytes, metadata: dict):
+        """Stores the PNG bytes of a rendered image with its metadata."""
+        image_path, meta_path = self.paths(key)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        # Write to temporary names first so readers never see partial files
+        suffix = f".{uuid.uuid4().hex}.tmp"
+        with open(image_path + suffix, "wb") as image_file:
+            image_file.write(data)
+        os.replace(image_path + suffix, image_path)
+        with open(meta_path + suffix, "w", encoding="utf-8") as meta_file:
+            json.dump(metadata, meta_file)
+        os.replace(meta_path + suffix, meta_path)
+
+        added = os.path.getsize(image_path) + os.path.getsize(meta_path)
+        with self.lock:
+            if self.size_estimate is None:
+                self.size_estimate = self.disk_usage()
+            else:
+                self.size_estimate += added
+            over_limit = self.size_estimate > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def entries(self):
+        """Returns the (last used, size, image path, metadata path) of every entry."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(root, name)
+                image_path = meta_path[:-len(".json")] + ".png"
+                try:
+                    meta_stat = os.stat(meta_path)
+                    image_stat = os.stat(image_path)
+                except OSError:
+                    continue
+                entries.append((
+                    max(meta_stat.st_mtime, image_stat.st_mtime),
+                    meta_stat.st_size + image_stat.st_size,
+                    image_path,
+                    meta_path
+                ))
+        return entries
+
+    def disk_usage(self):
+        """Returns the total size of the cached entries in bytes."""
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is back under RENDER_CACHE_EVICT_TO of max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(entry[1] for entry in entries)
+        target = self.max_bytes * RENDER_CACHE_EVICT_TO
+        removed = 0
+        for _, size, image_path, meta_path in entries:
+            if total <= target:
+                break
+            for path in (meta_path, image_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+        with self.lock:
+            self.size_estimate = total
+        print(f"Render cache evicted {removed} entries, {total} bytes remain.")
+
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """Returns the render cache of this process, or None if it is disabled."""
+    global _render_cache
+    if RENDER_CACHE_MAX_MB <= 0:
+        return None
+    with _render_cache_lock:
+        if _render_cache is None:
+            _render_cache = RenderCache(
+                RENDER_CACHE_DIR, RENDER_CACHE_MAX_MB * 1024 * 1024)
+        return _render_cache
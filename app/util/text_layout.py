@@ -0,0 +1,275 @@
+"""This is a utility module for fitting and wrapping text within a fixed area."""
+import os
+from functools import lru_cache
+
+from util.font_cache import get_font
+
+# Font size search bounds
+MIN_FONT_SIZE = 1
+MAX_FONT_SIZE = 500
+# Space between lines as a fraction of the font size
+LINE_SPACING_RATIO = 0.2
+# Size at which words are measured before being scaled to the probe size
+REFERENCE_FONT_SIZE = 1000
+# Hinting snaps each glyph advance and kerning pair to the pixel grid, so a
+# scaled width can drift from the shaped width by about half a pixel per
+# character. Widths closer to the limit than this are shaped for real.
+GLYPH_WIDTH_TOLERANCE = 1.0
+# Maximum number of word widths kept per font, the least recently used are dropped
+WORD_WIDTH_CACHE_SIZE = int(os.getenv("WORD_WIDTH_CACHE_SIZE", "10000"))
+# Maximum number of fonts with a width table
+WIDTH_TABLE_CACHE_SIZE = 8
+
+
+def get_text_width(font, text):
+    """Returns the width of the text when rendered with the given font."""
+    if hasattr(font, 'getlength'):
+        # For newer versions of Pillow
+        return font.getlength(text)
+    elif hasattr(font, 'getsize'):
+        # For older versions of Pillow
+        return font.getsize(text)[0]
+    elif hasattr(font, 'getbbox'):
+        # Alternative method
+        bbox = font.getbbox(text)
+        return bbox[2] - bbox[0]
+    else:
+        raise AttributeError(
+            "Font object has no method to calculate text width.")
+
+
+def does_text_fit(draw, text, font, width, height):
+    """Determines if the text fits within the specified width and height with the given font."""
+    ascent, descent = font.getmetrics()
+    line_spacing = int(font.size * LINE_SPACING_RATIO)
+
+    # Wrap the text
+    wrapped_text = []
+    lines = text.splitlines()
+    for line in lines:
+        words = line.split()
+        current_line = ""
+        for word in words:
+            test_line = f"{current_line} {word}".strip()
+            # Get text width
+            text_width = get_text_width(font, test_line)
+            if text_width <= width:
+                current_line = test_line
+            else:
+                if not current_line:
+                    # Single word longer than width, cannot fit
+                    return False, None, None
+                wrapped_text.append(current_line)
+                current_line = word
+        if current_line:
+            wrapped_text.append(current_line)
+
+    # Calculate total height for the wrapped text
+    num_lines = len(wrapped_text)
+    total_height = (ascent + descent) * num_lines + \
+        line_spacing * (num_lines - 1)
+
+    # Check if any line exceeds width
+    any_line_too_wide = any(get_text_width(font, line) > width for line in wrapped_text)
+
+    # Return whether text fits, the wrapped_text, and total_height
+    fits = (total_height <= height) and not any_line_too_wide
+    return fits, wrapped_text, total_height
+
+
+class GlyphWidthTable:
+    """
+    Word widths for a single font, measured once and scaled to any font size.
+    Each word is measured on its own and next to a space so that kerning
+    against the space is kept, which lets a line's width be summed from its
+    words. Only widths too close to the limit to decide from the scaled sum
+    are shaped at the real size, so wrapping matches does_text_fit exactly.
+    """
+
+    def __init__(self, font_path: str):
+        self.font_path = font_path
+        self.reference_font = get_font(font_path, REFERENCE_FONT_SIZE)
+        self.space_width = get_text_width(self.reference_font, " ")
+        # The model keeps coming up with new words, so the widths are bounded like the fonts
+        self.measure = lru_cache(maxsize=WORD_WIDTH_CACHE_SIZE)(self.measure_word)
+        self.exact_measurements = 0
+
+    def measure_word(self, word: str):
+        """
+        Returns the width, left space kerning and right space kerning of a
+        word at the reference size. Called through measure, which caches them.
+        """
+        font = self.reference_font
+        width = get_text_width(font, word)
+        left = get_text_width(font, f" {word}") - width - self.space_width
+        right = get_text_width(font, f"{word} ") - width - self.space_width
+        return width, left, right
+
+    def line_fits(self, font, line: str, estimate: float, width: int):
+        """Decides whether a line fits the width, shaping it only when the estimate is too close to call."""
+        margin = GLYPH_WIDTH_TOLERANCE * len(line) + 1
+        if estimate + margin <= width:
+            return True
+        if estimate - margin > width:
+            return False
+        self.exact_measurements += 1
+        return get_text_width(font, line) <= width
+
+    def does_text_fit(self, text: str, font, width: int, height: int):
+        """Same contract and result as does_text_fit, computed from the scaled word widths."""
+        ascent, descent = font.getmetrics()
+        line_spacing = int(font.size * LINE_SPACING_RATIO)
+        scale = font.size / REFERENCE_FONT_SIZE
+        space_width = self.space_width
+
+        wrapped_text = []
+        # Lines that were placed without their width being checked
+        unchecked = []
+        for line in text.splitlines():
+            current_line = ""
+            current_width = 0
+            current_right = 0
+            current_checked = False
+            for word in line.split():
+                word_width, left, right = self.measure(word)
+                if current_line:
+                    test_line = f"{current_line} {word}"
+                    test_width = current_width + current_right + \
+                        space_width + left + word_width
+                else:
+                    test_line = word
+                    test_width = word_width
+                if self.line_fits(font, test_line, test_width * scale, width):
+                    current_line = test_line
+                    current_width = test_width
+                    current_checked = True
+                else:
+                    if not current_line:
+                        # Single word longer than width, cannot fit
+                        return False, None, None
+                    wrapped_text.append(current_line)
+                    if not current_checked:
+                        unchecked.append((current_line, current_width))
+                    current_line = word
+                    current_width = word_width
+                    current_checked = False
+                current_right = right
+            if current_line:
+                wrapped_text.append(current_line)
+                if not current_checked:
+                    unchecked.append((current_line, current_width))
+
+        num_lines = len(wrapped_text)
+        total_height = (ascent + descent) * num_lines + \
+            line_spacing * (num_lines - 1)
+        if total_height > height:
+            return False, wrapped_text, total_height
+
+        # Checked lines already passed, only words that were pushed onto
+        # their own line can still be too wide
+        any_line_too_wide = any(
+            not self.line_fits(font, line, line_width * scale, width)
+            for line, line_width in unchecked)
+        return not any_line_too_wide, wrapped_text, total_height
+
+
+@lru_cache(maxsize=WIDTH_TABLE_CACHE_SIZE)
+def get_width_table(font_path: str):
+    """Returns the GlyphWidthTable for a font, shared by every layout that uses the font and built on first use."""
+    return GlyphWidthTable(font_path)
+
+
+class TextLayout:
+    """The font size and wrapped lines chosen for a text within an area."""
+
+    def __init__(self, font_size: int, lines: list, total_height: int):
+        self.font_size = font_size
+        self.lines = lines
+        # Height of the wrapped lines, excluding the descent of the last line
+        self.total_height = total_height
+
+
+def layout_text(
+        text: str,
+        width: int,
+        height: int,
+        font_path: str = None,
+        exact: bool = False,
+        max_font_size: int = MAX_FONT_SIZE
+):
+    """
+    Binary searches for the largest font size at which the text fits.
+    Args:
+        text (str): The text to lay out.
+        width (int): The available width in pixels.
+        height (int): The available height in pixels.
+        font_path (str, optional): The TrueType font to use, PIL's default
+            font is used when None.
+        exact (bool, optional): Shape every candidate line with does_text_fit
+            instead of using the width table (default is False).
+        max_font_size (int, optional): The largest font size to try.
+    Returns:
+        TextLayout: The best layout, or None if the text does not fit at the
+            minimum font size.
+    """
+    table = None
+    if font_path is not None and not exact:
+        table = get_width_table(font_path)
+
+    min_font_size = MIN_FONT_SIZE
+    best = None
+    while min_font_size <= max_font_size:
+        font_size = (min_font_size + max_font_size) // 2
+        font = get_font(font_path, font_size)
+
+        if table is not None:
+            fits, wrapped_text, total_height = table.does_text_fit(
+                text, font, width, height)
+        else:
+            fits, wrapped_text, total_height = does_text_fit(
+                None, text, font, width, height)
+        if fits:
+            # This font size fits, try a bigger one
+            best = TextLayout(font_size, wrapped_text, total_height)
+            min_font_size = font_size + 1
+        else:
+            # Font size too big, try a smaller one
+            max_font_size = font_size - 1
+    return best
+
+
+if __name__ == "__main__":
+    # Benchmark the width table against shaping every candidate line
+    import time
+    from util.font_cache import font_cache_stats
+
+    FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    slogans = [
+        "Welcome to the Bug-Free Zone - Powered by Unit Tests",
+        "I paused my game to be here, and honestly the respawn timer on "
+        "real life is way too long for my liking",
+        "Coffee first, then code, then more coffee, then a meeting that "
+        "could have been an email, then more code, then regret",
+        "Keep calm and let the integration tests run overnight while the "
+        "build server quietly questions every decision you ever made\n"
+        "- Sincerely, the CI pipeline",
+    ]
+    for size in [(2000, 2000), (1200, 800), (600, 600)]:
+        legacy_time = 0
+        table_time = 0
+        for slogan in slogans:
+            start = time.perf_counter()
+            legacy = layout_text(slogan, *size, FONT_PATH, exact=True)
+            legacy_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            fast = layout_text(slogan, *size, FONT_PATH)
+            table_time += time.perf_counter() - start
+
+            assert (legacy.font_size, legacy.lines, legacy.total_height) == \
+                (fast.font_size, fast.lines, fast.total_height)
+        print(f"{size[0]}x{size[1]}: shaped {legacy_time * 1000:.1f} ms, "
+              f"width table {table_time * 1000:.1f} ms "
+              f"({legacy_time / table_time:.1f}x faster)")
+    print("Exact measurements:", get_width_table(FONT_PATH).exact_measurements)
+    print("Font cache:", font_cache_stats())